@@ -0,0 +1,194 @@
+"""Persistent PokeAPI response cache for Pokedex.
+
+Responses are stored in the `api_responses` table (see `models.ApiResponse`)
+so they survive worker restarts and deploys.  Each resource kind has its own
+TTL; once an entry expires it is revalidated with If-None-Match /
+If-Modified-Since, so an unchanged resource costs a 304 instead of a body.
+For STALE_WINDOW seconds after expiry an entry may still be served while it
+is revalidated in the background.
+
+Set POKEAPI_CACHE=0 (the tests do) to turn the cache off.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, upsert, ApiResponse
+
+DAY = 24 * 60 * 60
+
+# Seconds before an entry must be revalidated, by resource kind.
+# Override one with e.g. POKEAPI_TTL_POKEMON_SPECIES=3600.
+TTLS = {
+    'pokemon': 7 * DAY,
+    'pokemon-species': 30 * DAY,
+    'evolution-chain': 30 * DAY,
+}
+DEFAULT_TTL = int(os.environ.get('POKEAPI_TTL_DEFAULT', DAY))
+
+for _kind in TTLS:
+    _env = 'POKEAPI_TTL_' + _kind.upper().replace('-', '_')
+    TTLS[_kind] = int(os.environ.get(_env, TTLS[_kind]))
+
+# Seconds past expiry an entry may be served while it is revalidated.
+STALE_WINDOW = int(os.environ.get('POKEAPI_STALE_WINDOW', 7 * DAY))
+
+enabled = os.environ.get('POKEAPI_CACHE', '1') != '0'
+
+# Coalesce cold fetches across workers with PostgreSQL advisory locks.
+SHARED_LOCKS = os.environ.get('POKEAPI_SHARED_LOCKS', '0') == '1'
+LOCK_WAIT = float(os.environ.get('POKEAPI_LOCK_WAIT', 5))
+
+Entry = namedtuple('Entry', 'url body etag last_modified expires_at')
+
+
+def set_enabled(value):
+    """Turn the response cache on or off for this process."""
+
+    global enabled
+    enabled = bool(value)
+
+
+def ttl_for(kind):
+    """Return the TTL in seconds for a resource kind."""
+
+    return TTLS.get(kind, DEFAULT_TTL)
+
+
+def lookup(url):
+    """Return the cached `Entry` for `url`, or None.
+
+    Database problems are treated as a miss: the cache must never be the
+    reason a page fails.
+    """
+
+    if not enabled:
+        return None
+    table = ApiResponse.__table__
+    try:
+        with db.engine.connect() as conn:
+            row = conn.execute(table.select().where(table.c.url == url)).first()
+    except SQLAlchemyError as e:
+        print(f'Error reading response cache: {e}')
+        return None
+    if row is None:
+        return None
+    return Entry(row.url, row.body, row.etag, row.last_modified, row.expires_at)
+
+
+def is_fresh(entry):
+    """Is `entry` still inside its TTL?"""
+
+    return entry.expires_at > datetime.datetime.now()
+
+
+def is_servable(entry):
+    """Is `entry` expired but still inside the stale window?"""
+
+    window = datetime.timedelta(seconds=STALE_WINDOW)
+    return entry.expires_at + window > datetime.datetime.now()
+
+
+def decode(entry):
+    """Return the json body of a cached entry."""
+
+    return json.loads(entry.body)
+
+
+def revalidation_headers(entry):
+    """Return conditional request headers for an expired entry."""
+
+    headers = {}
+    if entry is None:
+        return headers
+    if entry.etag:
+        headers['If-None-Match'] = entry.etag
+    if entry.last_modified:
+        headers['If-Modified-Since'] = entry.last_modified
+    return headers
+
+
+def store(url, kind, body, etag=None, last_modified=None):
+    """Insert or replace the cached response for `url`."""
+
+    if not enabled:
+        return
+    now = datetime.datetime.now()
+    values = {
+        'url': url,
+        'body': body,
+        'etag': etag,
+        'last_modified': last_modified,
+        'fetched_at': now,
+        'expires_at': now + datetime.timedelta(seconds=ttl_for(kind)),
+    }
+    try:
+        with db.engine.begin() as conn:
+            upsert(conn, ApiResponse.__table__, [values], 'url')
+    except SQLAlchemyError as e:
+        print(f'Error writing response cache: {e}')
+
+
+def touch(url, kind):
+    """Extend the TTL of `url` after a 304 Not Modified."""
+
+    if not enabled:
+        return
+    table = ApiResponse.__table__
+    expires_at = datetime.datetime.now() + datetime.timedelta(seconds=ttl_for(kind))
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.url == url)
+                         .values(expires_at=expires_at))
+    except SQLAlchemyError as e:
+        print(f'Error writing response cache: {e}')
+
+
+def _lock_key(url):
+    """Return a stable signed 64-bit advisory lock key for `url`."""
+
+    digest = hashlib.blake2b(url.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+@contextmanager
+def shared_lock(url):
+    """Try to become the one worker fetching `url`; yields True if we are.
+
+    Holds a PostgreSQL advisory lock for the duration of the block.  If
+    another worker holds it, yields False and the caller should wait for
+    that worker to `store` the response (see `lookup`).  Always yields True
+    when shared locks are off, the cache is off, or the database is not
+    PostgreSQL.
+    """
+
+    if not (enabled and SHARED_LOCKS):
+        yield True
+        return
+    try:
+        conn = db.engine.connect()
+    except SQLAlchemyError as e:
+        print(f'Error taking response cache lock: {e}')
+        yield True
+        return
+
+    try:
+        if conn.dialect.name != 'postgresql':
+            yield True
+            return
+        key = _lock_key(url)
+        acquired = conn.execute(
+            db.select([db.func.pg_try_advisory_lock(key)])).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(db.select([db.func.pg_advisory_unlock(key)]))
+    finally:
+        conn.close()
@@ -1,14 +1,24 @@
 """Flask app for Pokedex"""
-from flask import Flask, render_template, redirect, flash, session, g, request
+from flask import Flask, render_template, redirect, flash, session, g, request, abort, jsonify, url_for
 from flask_debugtoolbar import DebugToolbarExtension
 import requests
 
-from models import db, connect_db, User, Favorite, Pokemon
+import identity
+import metrics
+import sqlprofile
+from commands import pokedex_cli
+from models import db, connect_db, User, Favorite
+from pokeapi import UpstreamUnavailable, breaker_stats, degraded, get_json
+from pokedata import fetch_favorites, fetch_many, fetch_pokemon_data, load_pokemon_details
+from pokedata import filter_index, local_pokemon, remember_total, total_pokemon
+from caching import MISSING
 from forms import RegisterForm, LoginForm, UserEditForm
+from passwords import HasherBusy
 from pokemons import all_pokemon
+from nameindex import fuzzy_names, pokemon_names
+from filterindex import RANGE_FIELDS, parse_filters
 from sqlalchemy.exc import IntegrityError
 import math
-import random
 
 import os
 import re
@@ -24,7 +34,11 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = uri
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "shhhhhh")
-app.config['SQLALCHEMY_ECHO'] = True
+# Echo every statement only when asked to; sqlprofile logs the useful parts.
+app.config['SQLALCHEMY_ECHO'] = os.environ.get('SQLALCHEMY_ECHO') == '1'
+
+metrics.init_app(app)
+sqlprofile.init_app(app)
 
 try:
     connect_db(app)
@@ -32,8 +46,14 @@ try:
 except Exception as e:
     print(f"Database connection error: {e}")
 
+app.cli.add_command(pokedex_cli)
+
 CURR_USER_KEY = 'username'
-API_BASE_URL = 'https://pokeapi.co/api/v2'
+USER_SNAPSHOT_KEY = 'user_snapshot'
+FAVORITES_PER_PAGE = 24
+FILTER_PER_PAGE = 24
+BUSY_MESSAGE = "Lots of people are signing in right now. Please try again in a moment."
+DEGRADED_MESSAGE = "PokeAPI is having trouble right now, so some pokemon may be missing or out of date."
 
 
 if __name__ == "__main__":
@@ -54,39 +74,69 @@ def home_page(page=1):
 
     limit = 15
     offset = (page - 1) * limit
-    pokemon_data = []
+
+    # Pages past the end 404 without touching PokeAPI
+    if page < 1 or page > math.ceil(total_pokemon() / limit):
+        abort(404)
 
     try:
-        res = requests.get(
-            f'{API_BASE_URL}/pokemon/?limit={limit}&offset={offset}')
-        pokemon = res.json()['results']
-        for poke in pokemon:
-            data = fetch_pokemon_data(poke['name'])
-            pokemon_data.append(data)
-    except Exception as e:
-        # Log the exception and return an empty list
+        listing = get_json(f'pokemon/?limit={limit}&offset={offset}')
+        remember_total(listing['count'])
+        pokemon = listing['results']
+    except requests.exceptions.RequestException as e:
+        # Log the exception and list the page from the bundled names
         print(f'Error fetching pokemon list: {e}')
-        pokemon_data = []
+        pokemon = [{'name': name} for name in all_pokemon[offset:offset + limit]]
+
+    pokemon_data = fetch_many([poke['name'] for poke in pokemon])
+
+    if degraded():
+        flash(DEGRADED_MESSAGE, 'warning')
+
+    total_pages = math.ceil(total_pokemon() / limit)
+
+    return render_template('pokemon/home.html', pokemon_data=pokemon_data, isIndex=True, page=int(page), total_pages=int(total_pages))
+
+
+@app.route('/health')
+def health():
+    """Report the PokeAPI circuit breaker state for monitoring."""
+
+    return jsonify(degraded=degraded(), pokeapi=breaker_stats())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics, added up across gunicorn workers."""
+
+    body, content_type = metrics.render()
+    return body, 200, {'Content-Type': content_type}
 
-    # Get the total number of pokemon
-    total_pokemon = requests.get(f'{API_BASE_URL}/pokemon/').json()['count']
-    total_pages = math.ceil(total_pokemon / limit)
 
-    return render_template('pokemon/home.html', pokemon_data=pokemon_data, all_pokemon=all_pokemon, isIndex=True, page=int(page), total_pages=int(total_pages))
+@app.route('/api/autocomplete')
+def autocomplete():
+    """Pokemon names starting with ?q= (top ?limit=, default 10), for the search box."""
+
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    response = jsonify(query=query, results=pokemon_names.complete(query, limit))
+    # The name list only changes on deploy
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
 
 
 @app.errorhandler(404)
 def page_not_found(e):
     """Show 404 NOT FOUND page."""
 
-    return render_template('404.html', all_pokemon=all_pokemon), 404
+    return render_template('404.html'), 404
 
 
 @app.errorhandler(405)
 def method_not_allowed(e):
     """Show 405 METHOD NOT ALLOWED page."""
 
-    return render_template('405.html', all_pokemon=all_pokemon), 405
+    return render_template('405.html'), 405
 
 
 ##############################################################################
@@ -99,17 +149,35 @@ def add_user_to_g():
         g is a global namespace for holding any data you want during a single app context
     """
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    g.user = None
+    if CURR_USER_KEY not in session:
+        return
+
+    # The session carries a snapshot of the fields templates need, so most
+    # requests don't query the users table (see identity.py).
+    values = session.get(USER_SNAPSHOT_KEY)
+    if not identity.is_current(values, session[CURR_USER_KEY]):
+        user = User.query.get(session[CURR_USER_KEY])
+        if user is None:
+            do_logout()
+            return
+        values = remember_user(user)
+    g.user = identity.CurrentUser(values)
 
-    else:
-        g.user = None
+
+def remember_user(user):
+    """Store (or refresh) the session snapshot of `user`."""
+
+    values = identity.snapshot(user)
+    session[USER_SNAPSHOT_KEY] = values
+    return values
 
 
 def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    remember_user(user)
 
 
 def do_logout():
@@ -117,6 +185,7 @@ def do_logout():
 
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
+    session.pop(USER_SNAPSHOT_KEY, None)
 
 
 @app.route('/register', methods=["GET", "POST"])
@@ -140,6 +209,9 @@ def create_user():
             return redirect("/")
         except IntegrityError:
             form.username.errors.append('Username taken. Please pick another.')
+        except HasherBusy:
+            flash(BUSY_MESSAGE, 'warning')
+            return render_template('user/register.html', form=form), 503
 
     return render_template('user/register.html', form=form)
 
@@ -154,7 +226,11 @@ def login():
 
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data, form.password.data)
+        try:
+            user = User.authenticate(form.username.data, form.password.data)
+        except HasherBusy:
+            flash(BUSY_MESSAGE, 'warning')
+            return render_template('user/login.html', form=form), 503
 
         if user:
             do_login(user)
@@ -175,7 +251,7 @@ def logout():
         return redirect('/')
 
     if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
+        do_logout()
         flash("You've been logged out.", "success")
         return redirect('/')
 
@@ -186,17 +262,29 @@ def logout():
 @app.route('/user')
 def user_show_favorites():
     """Show user profile.
-        Show list of pokemon user has favorited.
+        Show list of pokemon user has favorited, a page at a time (?page=2).
     """
 
     if CURR_USER_KEY not in session:
         flash("Access unauthorized. You need to login first.", "primary")
         return redirect("/")
 
-    fav_pokemon = [fetch_pokemon_data(pokemon.name)
-                   for pokemon in g.user.favorites]
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(404)
+
+    total, fav_pokemon = fetch_favorites(
+        g.user.id, FAVORITES_PER_PAGE, (page - 1) * FAVORITES_PER_PAGE)
 
-    return render_template('user/favorites.html', user=g.user, favorites=fav_pokemon, all_pokemon=all_pokemon)
+    if degraded():
+        flash(DEGRADED_MESSAGE, 'warning')
+
+    total_pages = math.ceil(total / FAVORITES_PER_PAGE)
+    # Pages past the end 404, like the home page
+    if page > max(total_pages, 1):
+        abort(404)
+
+    return render_template('user/favorites.html', user=g.user, favorites=fav_pokemon, total=total, page=page, total_pages=total_pages)
 
 
 @app.route('/user/edit', methods=["GET", "POST"])
@@ -207,18 +295,19 @@ def profile():
         flash("Access unauthorized.", "primary")
         return redirect("/")
 
-    user = g.user
+    user = g.user.load()
 
     form = UserEditForm(obj=user)
     if form.validate_on_submit():
         try:
             if User.authenticate(user.username, form.password.data):
-                user.profile_img_url = form.profile_img_url.data or User.profile_img_url.default.arg,
+                user.profile_img_url = form.profile_img_url.data or User.profile_img_url.default.arg
                 user.username = form.username.data
                 user.location = form.location.data
                 user.email = form.email.data
 
                 db.session.commit()
+                remember_user(user)
                 flash(f"Your settings were saved!", "success")
                 return redirect(f"/user")
 
@@ -226,6 +315,9 @@ def profile():
             db.session.rollback()
             form.username.errors.append('Username taken. Please pick another.')
             return render_template('user/edit.html', form=form)
+        except HasherBusy:
+            flash(BUSY_MESSAGE, 'warning')
+            return render_template('user/edit.html', form=form), 503
 
         flash("Invalid password.", 'primary')
     return render_template('user/edit.html', form=form)
@@ -244,7 +336,7 @@ def delete_user():
 
     try:
         do_logout()
-        db.session.delete(g.user)
+        db.session.delete(g.user.load())
         db.session.commit()
         flash("Your account has been deleted.", "success")
     except:
@@ -256,103 +348,63 @@ def delete_user():
 ##############################################################################
 # GENERAL POKEMON SEARCH ROUTES
 
-def fetch_pokemon_data(pokemon_name):
-    """Return data for the given pokemon from PokeApi."""
-
-    def fetch_data(name):
-        """Fetch data for a single pokemon."""
-        try:
-            res = requests.get(f"{API_BASE_URL}/pokemon/{pokemon_name}")
-            return res.json()
-        except Exception as e:
-            # Log the exception and return an empty dictionary
-            print(f'Error fetching pokemon data: {e}')
-            return {}
-
-    data = fetch_data(pokemon_name)
-    pokemon = {
-        'id': data['id'],
-        'name': data['name'],
-        'image': data['sprites']['other']['official-artwork']['front_default'],
-        'pokedex_img': data['sprites']['front_default'],
-        'types': data['types'],
-        'base_xp': data['base_experience'],
-        'height': data['height'],
-        'weight': data['weight'],
-        'abilities': data['abilities'],
-        'pokedex_img_shiny': data['sprites']['front_shiny'],
-    }
-
-    return pokemon
-
-
-def fetch_evolutions(pokemon_name):
-    """Return a pokemon's evolutions (if exists) for given search term.
-        Not every pokemon will have more than one evolution, so a catch/error accounts for that.
+@app.route('/pokemon/')
+def search_poke():
+    """Handle form submission; return form, showing pokemon info from submission.
+    isIndex=True sets a variable so that we can pinpoint the route to only show search in nav bar if there is not already one on the page.
+    Without a search, ?type=, ?ability= and ?min_/max_ height, weight and base_xp filter the catalog instead.
     """
 
-    def fetch_chain_data(name):
-        """Fetch json data for a single pokemon's evolution chain."""
+    if not request.args.get('search'):
         try:
-            res = requests.get(f'{API_BASE_URL}/pokemon/{name}')
-            species_url = res.json()['species']['url']
-            res = requests.get(species_url)
-            evolution_url = res.json()['evolution_chain']['url']
-            res = requests.get(evolution_url)
-            return res.json()['chain']
-        except Exception as e:
-            # Log the exception and return an empty dictionary
-            print(f'Error fetching evolution data: {e}')
-            return {}
-    evolution_chain = fetch_chain_data(pokemon_name)
+            filters = parse_filters(request.args.to_dict(flat=False))
+        except ValueError:
+            abort(400)
+        if filters:
+            return filter_pokemon(filters)
 
-    evolution_names = []
+    search = request.args.get('search') or ''
+    name = search.strip().lower().replace(' ', '-')
 
-    def get_evolution_names(evolution_chain):
-        """Extracts evolution names from returned data"""
-        # get current evolution name
-        evolution_names.append(evolution_chain['species']['name'])
-        # get the names of any evolutions that come after the current one
-        for evolution in evolution_chain['evolves_to']:
-            get_evolution_names(evolution)
+    # Names we have never heard of (typos, mostly) don't cost a PokeAPI call
+    if not name or (not name.isdigit() and name not in fuzzy_names
+                    and local_pokemon([name])[0] is MISSING):
+        return render_template('/pokemon/no-results.html', search=search, suggestions=fuzzy_names.suggest(name), isIndex=True)
 
-    get_evolution_names(evolution_chain)
+    try:
+        pokemon = fetch_pokemon_data(name)
+    except requests.exceptions.RequestException:
+        return render_template('/pokemon/no-results.html', search=search, suggestions=fuzzy_names.suggest(name), isIndex=True)
 
-    return evolution_names
+    # return render_template('pokemon/results.html', pokemon=pokemon, isIndex=True)
+    return redirect(f'/pokemon/{name}')
 
 
-def fetch_blurb(pokemon_name, language):
-    """Generates a random fact in the specified language about the pokemon."""
+def filter_pokemon(filters):
+    """List the catalog pokemon matching `filters`, a page at a time (?page=2).
+    Served from this worker's in-memory filter index; never calls PokeAPI.
+    """
 
-    try:
-        get_species_url = requests.get(
-            f"{API_BASE_URL}/pokemon/{pokemon_name}").json()['species']['url']
-        data = requests.get(get_species_url).json()['flavor_text_entries']
-        blurbs = []
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(404)
 
-        for i in data:
-            if i['language']['name'] == language:
-                blurbs.append(i['flavor_text'])
+    total, pokemon_data = filter_index().page(
+        filters, FILTER_PER_PAGE, (page - 1) * FILTER_PER_PAGE)
+    total_pages = math.ceil(total / FILTER_PER_PAGE)
 
-        return random.choice(blurbs)
-    except:
-        return "Sorry, there was an error fetching the blurb for this pokemon."
+    args = request.args.to_dict(flat=False)
+    args.pop('page', None)
+    prev_url = url_for('search_poke', **args, page=page - 1) if page > 1 else None
+    next_url = url_for('search_poke', **args, page=page + 1) if page < total_pages else None
 
+    return render_template('pokemon/filter.html', pokemon_data=pokemon_data, filters=filters, total=total, range_fields=RANGE_FIELDS, prev_url=prev_url, next_url=next_url, isIndex=True)
 
-@app.route('/pokemon/')
-def search_poke():
-    """Handle form submission; return form, showing pokemon info from submission.
-    isIndex=True sets a variable so that we can pinpoint the route to only show search in nav bar if there is not already one on the page.
-    """
 
-    try:
-        search = request.args.get('search')
-        pokemon = fetch_pokemon_data(search.lower())
-    except requests.exceptions.JSONDecodeError:
-        return render_template('/pokemon/no-results.html', all_pokemon=all_pokemon, search=search, isIndex=True)
+def preferred_languages():
+    """Return the Accept-Language languages, best first (blurbs fall back to English)."""
 
-    # return render_template('pokemon/results.html', pokemon=pokemon, all_pokemon=all_pokemon, isIndex=True)
-    return redirect(f'/pokemon/{search.lower()}')
+    return [language for language, quality in request.accept_languages]
 
 
 @app.route('/pokemon/<pokemon_name>')
@@ -360,39 +412,32 @@ def poke_details(pokemon_name):
     """View details page of pokemon.
         Includes evolutions and random fact of the pokemon.
         Check if pokemon is in favorites if user is logged in.
+    The loaders run on the worker's background event loop (`load_pokemon_details`),
+    so the database work here stays on the request thread and its session.
     """
 
     try:
-        pokemon_data = fetch_pokemon_data(pokemon_name)
-        blurb = fetch_blurb(pokemon_name, 'en')
-
-        evolutions_list = fetch_evolutions(pokemon_name)
-        if len(evolutions_list) > 1:
-            evolutions_data = [fetch_pokemon_data(i) for i in evolutions_list]
-        else:
-            evolutions_data = [pokemon_data]
+        pokemon_data, blurb, evolutions_data = load_pokemon_details(
+            pokemon_name, preferred_languages())
+        if degraded():
+            flash(DEGRADED_MESSAGE, 'warning')
 
-        poke_id = pokemon_data['id']
+        # Fetched pokemon already have their `Pokemon` row (see `catalog.save`)
         name = pokemon_data['name']
 
-        check_pokemon = Pokemon.query.get(name)
-
-        if not check_pokemon:
-            add_pokemon = Pokemon(name=name, pokeapi_id=poke_id)
-            db.session.add(add_pokemon)
-            db.session.commit()
-
         if g.user:
-            pokemon = (Pokemon.query.all())
-            faved_pokemon_names = [
-                favorite.name for favorite in g.user.favorites]
-            return render_template('pokemon/show.html', pokemon=pokemon_data, blurb=blurb, evolutions=evolutions_data, all_pokemon=all_pokemon, favs=faved_pokemon_names)
+            faved_pokemon_names = {name} if Favorite.is_favorite(g.user.id, name) else set()
+            return render_template('pokemon/show.html', pokemon=pokemon_data, blurb=blurb, evolutions=evolutions_data, favs=faved_pokemon_names)
+
+        return render_template('pokemon/show.html', pokemon=pokemon_data, blurb=blurb, evolutions=evolutions_data)
 
-        return render_template('pokemon/show.html', pokemon=pokemon_data, blurb=blurb, evolutions=evolutions_data, all_pokemon=all_pokemon)
+    except UpstreamUnavailable:
+        flash(DEGRADED_MESSAGE, 'warning')
+        return render_template('404.html'), 503
 
-    except requests.exceptions.JSONDecodeError:
+    except requests.exceptions.RequestException:
         flash("Invalid path.", 'danger')
-        return render_template('404.html', all_pokemon=all_pokemon)
+        return render_template('404.html')
 
 
 ##############################################################################
@@ -413,17 +458,14 @@ def add_favorite(pokemon_name):
         # return redirect("/") # use this instead for testing
 
     try:
-        favorited_poke = Pokemon.query.get_or_404(pokemon_name)
-        user_favs = g.user.favorites
-        if favorited_poke in user_favs:
-            g.user.favorites = [
-                fav for fav in user_favs if fav != favorited_poke]
-            flash(f"{pokemon_name.title()} removed from favorites.", "success")
-        else:
-            g.user.favorites.append(favorited_poke)
+        if Favorite.toggle(g.user.id, pokemon_name):
             flash(f"{pokemon_name.title()} added to favorites.", "success")
+        else:
+            flash(f"{pokemon_name.title()} removed from favorites.", "success")
         db.session.commit()
     except:
+        # e.g. IntegrityError: no such pokemon
+        db.session.rollback()
         flash("There was an error updating your favorites.", "error")
 
     return redirect(request.referrer)  # https://stackoverflow.com/a/61902927
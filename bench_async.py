@@ -0,0 +1,211 @@
+"""Benchmark the page loaders on the background loop against a loop per request.
+
+The views call the async loaders through thin sync wrappers that run them
+on the worker's background event loop and pooled client
+(`pokeapi.run_sync`); the other path gives each "request" its own event
+loop and client, the way an async Flask view would.  Both talk to a local
+stand-in PokeAPI (`standin.py`, fixed latency per call, no network) serving
+generated payloads, and both are driven by the same number of threads.
+Every "request" asks for pokemon no earlier one has seen, so nothing is
+served from the in-process caches or the catalog.  What the loaders save
+goes to a throwaway SQLite catalog.
+
+run it like:
+
+    python bench_async.py --workers 4 --latency 0.05 --duration 10
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import parse_qs
+
+import apicache
+import pokeapi
+import pokedata
+import standin
+
+PAGE_SIZE = 15
+
+# Numbers each "request" so it asks for names nobody has fetched yet.
+requests_made = itertools.count()
+
+
+def chain_names(number):
+    """Return the species in generated evolution chain `number`."""
+
+    return [f'mon{number}', f'mon{number}-evo1', f'mon{number}-evo2']
+
+
+def setup_catalog():
+    """Point the catalog at a throwaway SQLite database and return its app.
+
+    The loaders store what they fetch through `catalog`, which needs an
+    app's engine.
+    """
+
+    from flask import Flask
+    from models import connect_db, db
+
+    app = Flask(__name__)
+    path = os.path.join(tempfile.mkdtemp(prefix='pokedex-bench-'), 'catalog.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    connect_db(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def fake_payload(url):
+    """Return (status, json) for a PokeAPI url, shaped like the real thing."""
+
+    path, _, query = url.partition('?')
+    kind, _, name = path.rstrip('/')[len(standin.UPSTREAM_URL) + 1:].partition('/')
+
+    if kind == 'pokemon' and not name:
+        query = parse_qs(query)
+        limit = int(query.get('limit', [20])[0])
+        offset = int(query.get('offset', [0])[0])
+        results = [{'name': f'poke{i}', 'url': f'{standin.UPSTREAM_URL}/pokemon/poke{i}/'}
+                   for i in range(offset, offset + limit)]
+        return 200, {'count': 10 ** 9, 'results': results}
+    if kind == 'pokemon':
+        return 200, {
+            # ids are unique in the catalog
+            'id': zlib.crc32(name.encode()), 'name': name, 'base_experience': 64, 'height': 7, 'weight': 69,
+            'types': [{'slot': 1, 'type': {'name': 'grass'}}],
+            'abilities': [{'ability': {'name': 'overgrow'}}],
+            'species': {'url': f'{standin.UPSTREAM_URL}/pokemon-species/{name}/'},
+            'sprites': {'front_default': 'front.png', 'front_shiny': 'shiny.png',
+                        'other': {'official-artwork': {'front_default': 'art.png'}}},
+        }
+    if kind == 'pokemon-species':
+        # monN, monN-evo1 and monN-evo2 share evolution chain N
+        number = name[3:].partition('-')[0]
+        chain_id = int(number) if name.startswith('mon') and number.isdigit() else 0
+        return 200, {
+            'name': name,
+            'flavor_text_entries': [{'flavor_text': 'A strange seed.', 'language': {'name': 'en'}}],
+            'evolution_chain': {'url': f'{standin.UPSTREAM_URL}/evolution-chain/{chain_id}/'},
+        }
+    if kind == 'evolution-chain':
+        names = chain_names(int(name))
+        chain = {'species': {'name': names[-1]}, 'evolves_to': []}
+        for species in reversed(names[:-1]):
+            chain = {'species': {'name': species}, 'evolves_to': [chain]}
+        return 200, {'id': int(name), 'chain': chain}
+    return 404, {'detail': 'Not found.'}
+
+
+class GeneratedFixtures(standin.Fixtures):
+    """Stand-in fixtures answering from `fake_payload` instead of files."""
+
+    def __init__(self):
+        super().__init__(directory=None)
+
+    def load(self):
+        pass
+
+    def get(self, kind, key):
+        status, body = fake_payload(f'{standin.UPSTREAM_URL}/{kind}/{key}')
+        return json.dumps(body) if status == 200 else None
+
+    def listing(self, kind, limit=20, offset=0):
+        return fake_payload(f'{standin.UPSTREAM_URL}/{kind}/?limit={limit}&offset={offset}')[1]
+
+
+##############################################################################
+# ONE "REQUEST" PER PATH
+#   Each asks for a page or pokemon of its own, so every call goes upstream.
+
+def home_path():
+    return f'pokemon/?limit={PAGE_SIZE}&offset={next(requests_made) * PAGE_SIZE}'
+
+
+def details_name():
+    return f'mon{next(requests_made)}'
+
+
+def sync_home():
+    pokemon = pokeapi.get_json(home_path())['results']
+    pokedata.fetch_many([poke['name'] for poke in pokemon])
+
+
+def sync_details():
+    pokedata.load_pokemon_details(details_name())
+
+
+def async_home():
+    async def view():
+        async with pokeapi.async_client() as client:
+            pokemon = (await pokeapi.aget_json(client, home_path()))['results']
+            await pokedata.afetch_many(client, [poke['name'] for poke in pokemon])
+    asyncio.run(view())
+
+
+def async_details():
+    async def view():
+        async with pokeapi.async_client() as client:
+            await pokedata.aload_pokemon_details(client, details_name())
+    asyncio.run(view())
+
+
+def drive(view, workers, duration):
+    """Call `view` from `workers` threads for `duration` seconds; return rps."""
+
+    completed = [0] * workers
+    stop = time.monotonic() + duration
+
+    def worker(i):
+        while time.monotonic() < stop:
+            view()
+            completed[i] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(completed) / (time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='simulated seconds per upstream call')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to run each scenario')
+    args = parser.parse_args()
+
+    apicache.set_enabled(False)
+    setup_catalog()
+    upstream = standin.StandInServer(('127.0.0.1', 0), GeneratedFixtures(),
+                                     latency=args.latency)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    # read at call time, so this redirects every fetch
+    pokeapi.API_BASE_URL = upstream.base_url
+
+    scenarios = [
+        ('home', sync_home, async_home),
+        ('details', sync_details, async_details),
+    ]
+    print(f'workers={args.workers} latency={args.latency}s duration={args.duration}s')
+    print(f"{'route':<10}{'bg loop rps':>13}{'per-request rps':>17}{'speedup':>10}")
+    for name, pooled_view, per_request_view in scenarios:
+        pooled_rps = drive(pooled_view, args.workers, args.duration)
+        per_request_rps = drive(per_request_view, args.workers, args.duration)
+        speedup = pooled_rps / per_request_rps if per_request_rps else float('nan')
+        print(f'{name:<10}{pooled_rps:>13.1f}{per_request_rps:>17.1f}{speedup:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""End-to-end load test for the Flask routes.
+
+Drives the app in-process (Flask test clients, one per thread) against a
+local database and the PokeAPI stand-in (`standin.py`), so nothing leaves
+the machine.  Reports throughput, p50/p95/p99 latency and upstream calls
+per request for each route, and writes the numbers as json so two branches
+can be compared.
+
+run it like:
+
+    createdb pokedex-bench
+    python bench_routes.py --concurrency 8 --duration 10 --latency 0.05 --output results.json
+    python bench_routes.py --compare results.json   # exits 1 on a p95 regression
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import standin
+
+USERNAME = 'benchuser'
+PASSWORD = 'benchpassword'
+
+
+##############################################################################
+# SETUP
+
+def setup_app(args):
+    """Point the app at the bench database and stand-in, then import it.
+
+    The app reads its configuration at import time, so the environment has
+    to be set first.
+    """
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['POKEAPI_BASE_URL'] = args.upstream.base_url
+    if args.no_cache:
+        os.environ['POKEAPI_CACHE'] = '0'
+
+    from app import app
+    from models import db, User
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['DEBUG_TB_ENABLED'] = False
+
+    db.drop_all()
+    db.create_all()
+    User.signup(email='bench@example.com', username=USERNAME, password=PASSWORD)
+    db.session.commit()
+    return app
+
+
+def logged_in_client(app):
+    """Return a test client with the bench user logged in."""
+
+    client = app.test_client()
+    client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+    return client
+
+
+##############################################################################
+# SCENARIOS
+#   Each takes a logged-in test client and the fixture pokemon names and
+#   returns a response.
+
+def home(client, names):
+    return client.get('/', follow_redirects=True)
+
+
+def page(client, names):
+    return client.get(f'/{random.randint(1, 3)}')
+
+
+def details(client, names):
+    return client.get(f'/pokemon/{random.choice(names)}')
+
+
+def search(client, names):
+    return client.get(f'/pokemon/?search={random.choice(names)}')
+
+
+def filter_search(client, names):
+    return client.get(f'/pokemon/?type={random.choice(["fire", "electric", "flying"])}&min_weight=10')
+
+
+def favorites(client, names):
+    return client.get('/user')
+
+
+def login(client, names):
+    # a fresh, logged-out client, so the password is actually checked
+    # (a logged-in one just gets redirected)
+    return client.application.test_client().post(
+        '/login', data={'username': USERNAME, 'password': PASSWORD})
+
+
+def favorite_toggle(client, names):
+    return client.post(f'/pokemon/{random.choice(names)}/fav',
+                       headers={'Referer': '/user'})
+
+
+SCENARIOS = {
+    'home': home,
+    'page': page,
+    'details': details,
+    'search': search,
+    'filter': filter_search,
+    'favorites': favorites,
+    'login': login,
+    'favorite': favorite_toggle,
+}
+
+
+##############################################################################
+# DRIVER
+
+def percentile(values, pct):
+    """Return the nearest-rank `pct` percentile of `values` (0 if empty)."""
+
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def upstream_calls(server):
+    return sum(server.calls.values())
+
+
+def run_scenario(app, scenario, names, concurrency, duration, warmup, server):
+    """Run `scenario` from `concurrency` threads for `duration` seconds."""
+
+    clients = [logged_in_client(app) for i in range(concurrency)]
+    for client in clients[:1]:
+        for i in range(warmup):
+            scenario(client, names)
+
+    latencies = [[] for i in range(concurrency)]
+    errors = [0] * concurrency
+    calls_before = upstream_calls(server)
+    stop = time.monotonic() + duration
+
+    def worker(i):
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                res = scenario(clients[i], names)
+                failed = res.status_code >= 500
+            except Exception as e:
+                print(f'Error in {scenario.__name__}: {e}', file=sys.stderr)
+                failed = True
+            latencies[i].append(time.perf_counter() - start)
+            if failed:
+                errors[i] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    samples = [seconds for worker_latencies in latencies for seconds in worker_latencies]
+    requests = len(samples)
+    return {
+        'requests': requests,
+        'errors': sum(errors),
+        'rps': requests / elapsed,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'upstream_calls_per_request': (upstream_calls(server) - calls_before) / max(requests, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print p95/rps changes against `baseline`; return True on a regression."""
+
+    regressed = False
+    print(f"\n{'route':<12}{'p95 before':>12}{'p95 now':>10}{'change':>9}{'rps change':>12}")
+    for name, now in results['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        p95_change = (now['p95_ms'] - before['p95_ms']) / max(before['p95_ms'], 1e-9)
+        rps_change = (now['rps'] - before['rps']) / max(before['rps'], 1e-9)
+        flag = ''
+        if p95_change > threshold:
+            regressed = True
+            flag = '  REGRESSION'
+        print(f"{name:<12}{before['p95_ms']:>12.1f}{now['p95_ms']:>10.1f}"
+              f"{p95_change:>+9.0%}{rps_change:>+12.0%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--routes', default=','.join(SCENARIOS),
+                        help='comma-separated scenarios to run')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to run each route')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='requests per route before measuring')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='stand-in seconds per upstream call')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='turn off the persistent PokeAPI response cache')
+    parser.add_argument('--database-url',
+                        default=os.environ.get('BENCH_DATABASE_URL', 'postgresql:///pokedex-bench'))
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--compare', help='json results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='p95 increase (fraction) that counts as a regression')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    args.upstream = standin.start(latency=args.latency, jitter=args.jitter,
+                                  error_rate=args.error_rate)
+    app = setup_app(args)
+    listing = args.upstream.fixtures.listing('pokemon', limit=100000)
+    names = [poke['name'] for poke in listing['results']]
+
+    results = {
+        'revision': git_revision(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'settings': {'concurrency': args.concurrency, 'duration': args.duration,
+                     'latency': args.latency, 'jitter': args.jitter,
+                     'error_rate': args.error_rate, 'cache': not args.no_cache},
+        'routes': {},
+    }
+    print(f'concurrency={args.concurrency} duration={args.duration}s '
+          f'latency={args.latency}s jitter={args.jitter}s')
+    print(f"{'route':<12}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'upstream/req':>14}{'errors':>8}")
+    for name in args.routes.split(','):
+        route = run_scenario(app, SCENARIOS[name], names, args.concurrency,
+                             args.duration, args.warmup, args.upstream)
+        results['routes'][name] = route
+        print(f"{name:<12}{route['rps']:>8.1f}{route['p50_ms']:>9.1f}{route['p95_ms']:>9.1f}"
+              f"{route['p99_ms']:>9.1f}{route['upstream_calls_per_request']:>14.2f}"
+              f"{route['errors']:>8}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nWrote {args.output}')
+
+    if baseline is not None and compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""In-process caches for Pokedex.
+
+Each gunicorn worker keeps its own copies; nothing here is shared between
+processes.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MISSING = object()
+# What a flight resolves to when its leader gave up (e.g. was cancelled).
+_ABANDONED = object()
+
+
+def approx_size(value):
+    """Roughly estimate the memory used by a json-like value, in bytes."""
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item) for item in value)
+    return size
+
+
+class TTLCache:
+    """Thread-safe LRU cache bounded by entry count and approximate memory.
+
+    Entries expire `ttl` seconds after they are set.  For `stale_ttl`
+    seconds after that they are stale: `get` misses, but `peek` still
+    returns them so callers can serve the old value while they refresh it.
+    When either bound is exceeded the least recently used entries are
+    evicted, except `pinned` keys, which are only ever replaced or expired.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=3600, stale_ttl=0, pinned=()):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.pinned = frozenset(pinned)
+        self._entries = OrderedDict()  # key -> (value, expires, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not MISSING
+
+    def get(self, key, count=True):
+        """Return the fresh cached value for `key`, or `MISSING`."""
+
+        value, stale = self.peek(key, count=False)
+        if stale:
+            value = MISSING
+        if count:
+            with self._lock:
+                if value is MISSING:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return value
+
+    def peek(self, key, count=True):
+        """Return (value, is_stale) for `key`; value is `MISSING` if absent."""
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] + self.stale_ttl <= now:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return MISSING, False
+            self._entries.move_to_end(key)
+            stale = entry[1] <= now
+            if count:
+                if stale:
+                    self.stale_hits += 1
+                else:
+                    self.hits += 1
+            return entry[0], stale
+
+    def set(self, key, value, ttl=None):
+        """Cache `value` under `key`, evicting old entries if needed."""
+
+        size = approx_size(value)
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, expires, size)
+            self._bytes += size
+            self._evict()
+
+    def pop(self, key):
+        """Drop `key` from the cache, if present."""
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.stale_hits = self.misses = 0
+            self.evictions = self.expirations = 0
+
+    def stats(self):
+        """Return the cache counters and current size."""
+
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _remove(self, key):
+        value, expires, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _over_limit(self):
+        if len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self._bytes > self.max_bytes
+
+    def _evict(self):
+        """Evict least recently used, unpinned entries until within bounds."""
+
+        if not self._over_limit():
+            return
+        for key in list(self._entries):
+            if key in self.pinned:
+                continue
+            self._remove(key)
+            self.evictions += 1
+            if not self._over_limit():
+                return
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one in-flight call.
+
+    The first caller for a key (the leader) runs the call; anyone asking for
+    the same key before it finishes waits for and shares its result (or
+    exception).  Works across threads and across event loops, so sync and
+    async callers in one worker can share a flight.  Shared results must be
+    treated as read-only.
+
+    A leader that is cancelled (or otherwise interrupted) doesn't pass that
+    on: the key is released and a waiting follower runs the call instead.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return `fn()`, or the result of an identical call already in flight."""
+
+        while True:
+            future, leader = self._claim(key)
+            if leader:
+                break
+            result = future.result()
+            if result is not _ABANDONED:
+                return result
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    async def ado(self, key, fn):
+        """Async `do`: `fn` returns an awaitable."""
+
+        while True:
+            future, leader = self._claim(key)
+            if leader:
+                break
+            # shielded: a cancelled follower must not cancel the shared future
+            result = await asyncio.shield(asyncio.wrap_future(future))
+            if result is not _ABANDONED:
+                return result
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def stats(self):
+        """Return how many calls ran and how many were coalesced into them."""
+
+        with self._lock:
+            return {'in_flight': len(self._calls),
+                    'leaders': self.leaders,
+                    'coalesced': self.coalesced}
+
+    def _claim(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None and not isinstance(error, Exception):
+            future.set_result(_ABANDONED)
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+class BackgroundRefresher:
+    """Run refreshes on a small per-worker thread pool, one per key at a time.
+
+    Used for stale-while-revalidate: a request serves the stale value and
+    hands the refresh to `submit`, which ignores keys already being
+    refreshed.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.failed = 0
+
+    def submit(self, key, fn):
+        """Schedule `fn()` unless `key` is already being refreshed."""
+
+        with self._lock:
+            executor = self._get_executor()
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            self.scheduled += 1
+        executor.submit(self._run, key, fn)
+        return True
+
+    def stats(self):
+        """Return how many refreshes were scheduled, failed and are pending."""
+
+        with self._lock:
+            return {'pending': len(self._pending),
+                    'scheduled': self.scheduled,
+                    'failed': self.failed}
+
+    def _get_executor(self):
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='refresh')
+            self._executor_pid = pid
+            self._pending.clear()
+        return self._executor
+
+    def _run(self, key, fn):
+        try:
+            fn()
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            print(f'Error refreshing {key}: {e}')
+        finally:
+            with self._lock:
+                self._pending.discard(key)
@@ -0,0 +1,182 @@
+"""Local pokemon catalog for Pokedex.
+
+Reads and writes `models.PokemonData` through the engine rather than the
+scoped session, so it is safe to call from the fetch thread pool.  Database
+problems are treated as a miss so the views can still fall back to PokeAPI.
+"""
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, upsert, Favorite, FlavorText, Pokemon, PokemonData
+
+
+def lookup(pokemon_name):
+    """Return the catalog dict for `pokemon_name`, or None."""
+
+    return lookup_many([pokemon_name]).get(pokemon_name)
+
+
+def lookup_many(pokemon_names):
+    """Return {name: catalog dict} for those of `pokemon_names` in the catalog."""
+
+    if not pokemon_names:
+        return {}
+    table = PokemonData.__table__
+    try:
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                table.select().where(table.c.name.in_(list(pokemon_names))))
+            return {row.name: PokemonData.row_to_dict(row) for row in rows}
+    except SQLAlchemyError as e:
+        print(f'Error reading pokemon catalog: {e}')
+        return {}
+
+
+def load_all():
+    """Return every catalog dict, in national dex order (empty if unavailable)."""
+
+    table = PokemonData.__table__
+    try:
+        with db.engine.connect() as conn:
+            rows = conn.execute(table.select().order_by(table.c.pokeapi_id))
+            return [PokemonData.row_to_dict(row) for row in rows]
+    except SQLAlchemyError as e:
+        print(f'Error reading pokemon catalog: {e}')
+        return []
+
+
+def favorites_page(user_id, limit, offset=0):
+    """Return (total, [(name, catalog dict or None)]) for a page of favorites.
+
+    One query joins the user's favorites (newest first) to the catalog and
+    counts them; favorites missing from the catalog come back as None.  A
+    page past the end is empty but still reports the real total.
+    """
+
+    favorites = Favorite.__table__
+    data = PokemonData.__table__
+    query = (db.select([favorites.c.poke_name.label('favorite_name'),
+                        db.func.count().over().label('total'),
+                        *data.columns])
+             .select_from(favorites.outerjoin(data, data.c.name == favorites.c.poke_name))
+             .where(favorites.c.user_id == user_id)
+             .order_by(favorites.c.timestamp.desc(), favorites.c.poke_name)
+             .limit(limit).offset(offset))
+    try:
+        with db.engine.connect() as conn:
+            rows = conn.execute(query).fetchall()
+    except SQLAlchemyError as e:
+        print(f'Error reading favorites: {e}')
+        return 0, []
+    if not rows:
+        return (count_favorites(user_id) if offset else 0), []
+    return rows[0].total, [
+        (row.favorite_name,
+         PokemonData.row_to_dict(row) if row.pokeapi_id is not None else None)
+        for row in rows]
+
+
+def count_favorites(user_id):
+    """Return how many pokemon `user_id` has favorited (0 if unavailable)."""
+
+    favorites = Favorite.__table__
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.select([db.func.count()]).select_from(favorites)
+                .where(favorites.c.user_id == user_id)).scalar()
+    except SQLAlchemyError as e:
+        print(f'Error reading favorites: {e}')
+        return 0
+
+
+def count():
+    """Return the number of pokemon in the catalog (0 if unavailable)."""
+
+    table = PokemonData.__table__
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.select([db.func.count()]).select_from(table)).scalar()
+    except SQLAlchemyError as e:
+        print(f'Error reading pokemon catalog: {e}')
+        return 0
+
+
+def known_names():
+    """Return the set of pokemon names already in the catalog."""
+
+    table = PokemonData.__table__
+    try:
+        with db.engine.connect() as conn:
+            return {row.name for row in conn.execute(db.select([table.c.name]))}
+    except SQLAlchemyError as e:
+        print(f'Error reading pokemon catalog: {e}')
+        return set()
+
+
+def save(pokemons):
+    """Insert or update catalog rows for a batch of projected pokemon dicts.
+
+    Matching `Pokemon` rows are created first (they are what favorites
+    point at), so a synced pokemon can be favorited straight away.
+    """
+
+    if not pokemons:
+        return
+    pokemon_rows = [{'name': p['name'], 'pokeapi_id': p['id']} for p in pokemons]
+    data_rows = [PokemonData.dict_to_row(p) for p in pokemons]
+    try:
+        with db.engine.begin() as conn:
+            upsert(conn, Pokemon.__table__, pokemon_rows, 'name', update=False)
+            upsert(conn, PokemonData.__table__, data_rows, 'name')
+    except SQLAlchemyError as e:
+        print(f'Error writing pokemon catalog: {e}')
+
+
+def flavor_texts(name):
+    """Return {language: [texts]} stored for a species/pokemon name, or None."""
+
+    table = FlavorText.__table__
+    try:
+        with db.engine.connect() as conn:
+            rows = conn.execute(table.select().where(table.c.name == name)).fetchall()
+    except SQLAlchemyError as e:
+        print(f'Error reading flavor texts: {e}')
+        return None
+    if not rows:
+        return None
+    return {row.language: row.texts for row in rows}
+
+
+def known_flavor_names():
+    """Return the set of names that already have flavor texts stored."""
+
+    table = FlavorText.__table__
+    try:
+        with db.engine.connect() as conn:
+            return {row.name for row in conn.execute(
+                db.select([table.c.name]).distinct())}
+    except SQLAlchemyError as e:
+        print(f'Error reading flavor texts: {e}')
+        return set()
+
+
+def save_flavor_texts(entries):
+    """Store a batch of {name: {language: [texts]}} flavor texts.
+
+    Upserts on (name, language), so workers storing the same species at
+    once can't trip over each other.
+    """
+
+    rows = [{'name': name, 'language': language, 'texts': texts}
+            for name, by_language in entries.items()
+            for language, texts in by_language.items()]
+    if not rows:
+        return
+    table = FlavorText.__table__
+    try:
+        with db.engine.begin() as conn:
+            upsert(conn, table, rows, ('name', 'language'))
+    except SQLAlchemyError as e:
+        print(f'Error writing flavor texts: {e}')
@@ -0,0 +1,99 @@
+"""Circuit breaker for upstream calls.
+
+Each gunicorn worker keeps its own breaker; nothing here is shared between
+processes.
+"""
+
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Stop calling an upstream that keeps failing or is too slow.
+
+    After `failure_threshold` consecutive failures (a call slower than
+    `slow_call_seconds` counts as one) the breaker opens and `allow`
+    refuses calls for `reset_timeout` seconds.  It then goes half-open and
+    lets up to `half_open_probes` calls through: a success closes it, a
+    failure opens it again.  Every call `allow` lets through must be
+    reported with `record_success` or `record_failure`.
+    """
+
+    def __init__(self, failure_threshold=5, slow_call_seconds=None,
+                 reset_timeout=30, half_open_probes=1):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+        self.slow_calls = 0
+
+    def allow(self):
+        """Return True if a call may go upstream now."""
+
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self.rejected += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def is_open(self):
+        """Is the breaker refusing calls (open and not yet due a probe)?"""
+
+        with self._lock:
+            return (self.state == OPEN
+                    and time.monotonic() - self._opened_at < self.reset_timeout)
+
+    def record_success(self, seconds=0):
+        """Report a call that reached the upstream and got a usable answer."""
+
+        if self.slow_call_seconds is not None and seconds > self.slow_call_seconds:
+            with self._lock:
+                self.slow_calls += 1
+            self.record_failure()
+            return
+        with self._lock:
+            self._failures = 0
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self._probes = 0
+
+    def record_failure(self):
+        """Report a call that failed (or breached the latency SLO)."""
+
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._probes = 0
+
+    def stats(self):
+        """Return the breaker state and counters."""
+
+        with self._lock:
+            return {'state': self.state,
+                    'consecutive_failures': self._failures,
+                    'opened': self.opened,
+                    'rejected': self.rejected,
+                    'slow_calls': self.slow_calls}
@@ -0,0 +1,102 @@
+"""Flask CLI commands for Pokedex.
+
+run them like:
+
+    flask pokedex sync
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+import requests
+from flask.cli import AppGroup
+
+import apicache
+import catalog
+from pokeapi import get_json
+from pokedata import flavor_texts_by_language, project_pokemon
+
+pokedex_cli = AppGroup('pokedex', help='Manage the local pokemon catalog.')
+
+
+@pokedex_cli.command('sync')
+@click.option('--concurrency', default=16, show_default=True,
+              help='Upstream fetches in flight at once.')
+@click.option('--batch-size', default=100, show_default=True,
+              help='Rows written per INSERT.')
+@click.option('--limit', type=int, default=None,
+              help='Only sync the first N pokemon.')
+@click.option('--refresh', is_flag=True,
+              help='Re-fetch pokemon already in the catalog.')
+@click.option('--flavor-text/--no-flavor-text', default=True, show_default=True,
+              help='Also preprocess every species\' flavor texts.')
+def sync(concurrency, batch_size, limit, refresh, flavor_text):
+    """Bulk-load the pokemon catalog from PokeAPI."""
+
+    # Raw payloads go straight into the catalog; don't also keep every
+    # (large) /pokemon body in the response cache.
+    apicache.set_enabled(False)
+
+    listing = get_json('pokemon/?limit=100000')['results']
+    names = [poke['name'] for poke in listing][:limit]
+    if not refresh:
+        known = catalog.known_names()
+        names = [name for name in names if name not in known]
+    click.echo(f'Syncing {len(names)} pokemon...')
+
+    batch = []
+    synced = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(get_json, f'pokemon/{name}'): name
+                   for name in names}
+        for future in as_completed(futures):
+            try:
+                batch.append(project_pokemon(future.result()))
+            except (requests.exceptions.RequestException, KeyError) as e:
+                failed += 1
+                click.echo(f'  failed {futures[future]}: {e}', err=True)
+            if len(batch) >= batch_size:
+                catalog.save(batch)
+                synced += len(batch)
+                batch = []
+                click.echo(f'  {synced}/{len(names)}')
+    catalog.save(batch)
+    synced += len(batch)
+
+    click.echo(f'Synced {synced} pokemon ({failed} failed).')
+
+    if flavor_text:
+        sync_flavor_texts(concurrency, batch_size, limit, refresh)
+
+
+def sync_flavor_texts(concurrency, batch_size, limit, refresh):
+    """Load every species' flavor texts into the flavor text store."""
+
+    listing = get_json('pokemon-species/?limit=100000')['results']
+    names = [species['name'] for species in listing][:limit]
+    if not refresh:
+        known = catalog.known_flavor_names()
+        names = [name for name in names if name not in known]
+    click.echo(f'Syncing flavor texts for {len(names)} species...')
+
+    batch = {}
+    synced = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(get_json, f'pokemon-species/{name}'): name
+                   for name in names}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                batch[name] = flavor_texts_by_language(future.result())
+            except (requests.exceptions.RequestException, KeyError) as e:
+                failed += 1
+                click.echo(f'  failed {name}: {e}', err=True)
+            if len(batch) >= batch_size:
+                catalog.save_flavor_texts(batch)
+                synced += len(batch)
+                batch = {}
+                click.echo(f'  {synced}/{len(names)}')
+    catalog.save_flavor_texts(batch)
+    synced += len(batch)
+
+    click.echo(f'Synced flavor texts for {synced} species ({failed} failed).')
@@ -0,0 +1,130 @@
+"""In-memory filter index over the pokemon catalog for Pokedex.
+
+Answers `/pokemon/?type=fire&ability=blaze&min_weight=100` style searches
+without the database or PokeAPI: types and abilities are inverted postings
+(name -> positions), and height, weight and base_xp are sorted arrays that
+a range is cut out of with bisect.  Built from the catalog dicts (the shape
+of `pokedata.project_pokemon`), one per worker.
+"""
+
+from bisect import bisect_left, bisect_right
+
+RANGE_FIELDS = ('height', 'weight', 'base_xp')
+
+
+def type_names(pokemon):
+    """Return the type names of a catalog dict ('fire', 'flying')."""
+
+    return [entry['type']['name'] for entry in pokemon.get('types') or ()]
+
+
+def ability_names(pokemon):
+    """Return the ability names of a catalog dict ('blaze', 'solar-power')."""
+
+    return [entry['ability']['name'] for entry in pokemon.get('abilities') or ()]
+
+
+def _split(values):
+    """['fire,flying', 'Grass'] -> ['fire', 'flying', 'grass']"""
+
+    return [part.strip().lower().replace(' ', '-')
+            for value in values for part in value.split(',') if part.strip()]
+
+
+def parse_filters(args):
+    """Return the filters in `args` ({name: [values]}), or None if there are none.
+
+    `type` and `ability` may repeat or be comma separated; a pokemon must
+    have all of them.  `min_<field>`/`max_<field>` are inclusive bounds on
+    the RANGE_FIELDS.  Raises ValueError for a bound that isn't a whole
+    number.
+    """
+
+    filters = {'types': _split(args.get('type', ())),
+               'abilities': _split(args.get('ability', ())),
+               'ranges': {}}
+    for field in RANGE_FIELDS:
+        low = [value for value in args.get(f'min_{field}', ()) if value.strip()]
+        high = [value for value in args.get(f'max_{field}', ()) if value.strip()]
+        if low or high:
+            filters['ranges'][field] = (int(low[-1]) if low else None,
+                                        int(high[-1]) if high else None)
+    if not (filters['types'] or filters['abilities'] or filters['ranges']):
+        return None
+    return filters
+
+
+class FilterIndex:
+    """Inverted postings and sorted stat arrays over a list of pokemon dicts.
+
+    Results are always in national dex order.
+    """
+
+    def __init__(self, pokemons):
+        self.pokemon = sorted(pokemons, key=lambda pokemon: pokemon['id'])
+        self.types = {}      # type name -> [position]
+        self.abilities = {}  # ability name -> [position]
+        for position, pokemon in enumerate(self.pokemon):
+            for name in set(type_names(pokemon)):
+                self.types.setdefault(name, []).append(position)
+            for name in set(ability_names(pokemon)):
+                self.abilities.setdefault(name, []).append(position)
+        # field -> ([sorted values], [position for each value])
+        self.ranges = {}
+        for field in RANGE_FIELDS:
+            pairs = sorted((pokemon[field], position)
+                           for position, pokemon in enumerate(self.pokemon)
+                           if pokemon.get(field) is not None)
+            self.ranges[field] = ([value for value, position in pairs],
+                                  [position for value, position in pairs])
+
+    def __len__(self):
+        return len(self.pokemon)
+
+    def match(self, filters):
+        """Return the positions of the pokemon matching `filters`, in dex order."""
+
+        clauses = []  # (size, positions, test)
+        for name in filters.get('types', ()):
+            positions = self.types.get(name, [])
+            clauses.append((len(positions), positions, positions))
+        for name in filters.get('abilities', ()):
+            positions = self.abilities.get(name, [])
+            clauses.append((len(positions), positions, positions))
+        for field, (low, high) in filters.get('ranges', {}).items():
+            values, positions = self.ranges[field]
+            start = 0 if low is None else bisect_left(values, low)
+            stop = len(values) if high is None else bisect_right(values, high)
+            positions = positions[start:stop] if start < stop else []
+            clauses.append((len(positions), positions, (field, low, high)))
+        if not clauses:
+            return list(range(len(self.pokemon)))
+
+        # Start from the most selective clause; check the rest against it.
+        # Range clauses are checked on the pokemon's own value, which is
+        # cheaper than building a set from a wide range.
+        clauses.sort(key=lambda clause: clause[0])
+        matches = set(clauses[0][1])
+        for size, positions, test in clauses[1:]:
+            if not matches:
+                break
+            if isinstance(test, tuple):
+                field, low, high = test
+                matches = {position for position in matches
+                           if self._in_range(self.pokemon[position].get(field), low, high)}
+            else:
+                matches.intersection_update(positions)
+        return sorted(matches)
+
+    def page(self, filters, limit, offset=0):
+        """Return (total, [pokemon dicts]) for one page of matches."""
+
+        positions = self.match(filters)
+        return len(positions), [self.pokemon[position]
+                                for position in positions[offset:offset + limit]]
+
+    @staticmethod
+    def _in_range(value, low, high):
+        return (value is not None
+                and (low is None or value >= low)
+                and (high is None or value <= high))
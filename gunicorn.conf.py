@@ -0,0 +1,36 @@
+"""gunicorn settings for Pokedex (loaded automatically by `gunicorn app:app`).
+
+Runs threaded workers, so one slow request (a cold page waiting on PokeAPI,
+a bcrypt check) doesn't hold up every other request to that worker; the
+password hash queue in `passwords.py` caps how many of a worker's threads
+sign-ins can take.  Also sets up prometheus_client's multiprocess mode so
+`/metrics` reports every worker, not just the one that served the scrape.
+"""
+
+import os
+import shutil
+import tempfile
+
+from prometheus_client import multiprocess
+
+# gunicorn reads WEB_CONCURRENCY for the number of worker processes.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Must be set before any worker imports prometheus_client.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(tempfile.gettempdir(), 'pokedex-metrics'))
+
+
+def on_starting(server):
+    """Start from an empty metrics directory on every (re)deploy."""
+
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges; its counters are kept."""
+
+    multiprocess.mark_process_dead(worker.pid)
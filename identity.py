@@ -0,0 +1,60 @@
+"""Logged-in user identity for Pokedex.
+
+`add_user_to_g` used to load the `User` row on every request.  Instead the
+few fields the templates need are kept in the (signed) session cookie, so
+most requests never query the users table; `CurrentUser` loads the full row
+only when a route needs something else, or needs to change it.
+"""
+
+import os
+import time
+
+from models import User
+
+# Seconds before a snapshot is re-read from the database, so changes made
+# from another browser show up eventually.
+SNAPSHOT_TTL = float(os.environ.get('POKEDEX_IDENTITY_TTL', 300))
+FIELDS = ('id', 'username', 'location', 'profile_img_url')
+
+
+def snapshot(user):
+    """Return the session snapshot for a `User`."""
+
+    values = {field: getattr(user, field) for field in FIELDS}
+    values['taken_at'] = time.time()
+    return values
+
+
+def is_current(values, user_id):
+    """Is `values` a snapshot of `user_id` that is still within its TTL?"""
+
+    return (bool(values)
+            and values.get('id') == user_id
+            and time.time() - values.get('taken_at', 0) < SNAPSHOT_TTL)
+
+
+class CurrentUser:
+    """The logged-in user, answered from a snapshot where possible.
+
+    Reading a snapshot field is free; anything else (or `load()`) fetches
+    the `User` row once per request.  Mutate the row from `load()`.
+    """
+
+    def __init__(self, values):
+        self._values = values
+        self._user = None
+
+    def load(self):
+        """Return the `User` row, querying it on first use."""
+
+        if self._user is None:
+            self._user = User.query.get(self._values['id'])
+        return self._user
+
+    def __getattr__(self, name):
+        if name in FIELDS:
+            return self._values[name]
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self._values['id']}: {self._values['username']}>"
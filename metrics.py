@@ -0,0 +1,162 @@
+"""Prometheus metrics for Pokedex.
+
+Times every request, and the part of it spent in PokeAPI calls, SQL queries
+and Jinja rendering, per route (Flask endpoint).  Under gunicorn each worker
+writes its samples to PROMETHEUS_MULTIPROC_DIR (set up by gunicorn.conf.py)
+and `/metrics` adds them up across workers; without it, `/metrics` reports
+this process only.
+"""
+
+import os
+import time
+from contextvars import ContextVar
+
+from flask import before_render_template, g, request, template_rendered
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry,
+                               Counter, Histogram, generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REQUEST_SECONDS = Histogram(
+    'pokedex_request_seconds', 'Time to serve a request.', ['route', 'method'])
+PHASE_SECONDS = Histogram(
+    'pokedex_request_phase_seconds',
+    'Time a request spent in PokeAPI calls, SQL queries or template rendering.',
+    ['route', 'phase'])
+REQUEST_UPSTREAM_CALLS = Histogram(
+    'pokedex_request_upstream_calls', 'PokeAPI calls made by one request.',
+    ['route'], buckets=COUNT_BUCKETS)
+REQUEST_DB_QUERIES = Histogram(
+    'pokedex_request_db_queries', 'SQL queries run by one request.',
+    ['route'], buckets=COUNT_BUCKETS)
+UPSTREAM_SECONDS = Histogram(
+    'pokedex_upstream_seconds', 'PokeAPI call latency.', ['endpoint', 'outcome'])
+REPEATED_QUERIES = Counter(
+    'pokedex_sql_repeated_query_requests',
+    'Profiled requests that ran one SQL statement many times (likely N+1).',
+    ['route'])
+UPSTREAM_CACHE_HITS = Counter(
+    'pokedex_upstream_cache_hits', 'PokeAPI calls answered from the response cache.',
+    ['endpoint', 'stale'])
+
+
+class RequestStats:
+    """Time and call counts accumulated while serving one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = None
+
+
+# Set for the duration of a request; asyncio tasks started by async views
+# see the same object.  Work on other threads (the fetch pool, background
+# refreshes) is not attributed to the request.
+_request_stats = ContextVar('pokedex_request_stats', default=None)
+
+
+def current_stats():
+    """Return the `RequestStats` of the request being served, or None."""
+
+    return _request_stats.get()
+
+
+def record_upstream(endpoint, seconds, outcome):
+    """Record one PokeAPI call; `outcome` is 'ok', 'error' or 'not_modified'."""
+
+    UPSTREAM_SECONDS.labels(endpoint, outcome).observe(seconds)
+    stats = current_stats()
+    if stats is not None:
+        stats.upstream_calls += 1
+        stats.upstream_seconds += seconds
+
+
+def record_cache_hit(endpoint, stale=False):
+    """Record a PokeAPI call answered from the response cache."""
+
+    UPSTREAM_CACHE_HITS.labels(endpoint, 'true' if stale else 'false').inc()
+
+
+def record_repeated_queries(route):
+    """Count a profiled request with a likely N+1 query pattern."""
+
+    REPEATED_QUERIES.labels(route).inc()
+
+
+def render():
+    """Return (body, content type) for the `/metrics` endpoint."""
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+##############################################################################
+# HOOKS
+
+def init_app(app):
+    """Instrument `app`; call before registering other request hooks."""
+
+    app.before_request(_start_request)
+    app.teardown_request(_finish_request)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_finish_render, app)
+    if not event.contains(Engine, 'before_cursor_execute', _start_query):
+        event.listen(Engine, 'before_cursor_execute', _start_query)
+        event.listen(Engine, 'after_cursor_execute', _finish_query)
+
+
+def _start_request():
+    g.request_stats_token = _request_stats.set(RequestStats())
+
+
+def _finish_request(exception=None):
+    stats = current_stats()
+    if stats is None:
+        return
+    route = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.labels(route, request.method).observe(
+        time.perf_counter() - stats.start)
+    PHASE_SECONDS.labels(route, 'upstream').observe(stats.upstream_seconds)
+    PHASE_SECONDS.labels(route, 'sql').observe(stats.db_seconds)
+    PHASE_SECONDS.labels(route, 'template').observe(stats.render_seconds)
+    REQUEST_UPSTREAM_CALLS.labels(route).observe(stats.upstream_calls)
+    REQUEST_DB_QUERIES.labels(route).observe(stats.db_queries)
+
+    token = g.pop('request_stats_token', None)
+    if token is not None:
+        _request_stats.reset(token)
+
+
+def _start_render(sender, template, context, **extra):
+    stats = current_stats()
+    if stats is not None:
+        stats.render_started = time.perf_counter()
+
+
+def _finish_render(sender, template, context, **extra):
+    stats = current_stats()
+    if stats is not None and stats.render_started is not None:
+        stats.render_seconds += time.perf_counter() - stats.render_started
+        stats.render_started = None
+
+
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _finish_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.db_queries += 1
+        stats.db_seconds += time.perf_counter() - started
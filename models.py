@@ -2,10 +2,10 @@
 
 import datetime
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+
+from passwords import HasherBusy, hasher
 
 db = SQLAlchemy()
-bcrypt = Bcrypt()
 
 DEFAULT_AVATAR_IMG = "https://cdn.landesa.org/wp-content/uploads/default-user-image.png"
 
@@ -16,6 +16,44 @@ def connect_db(app):
     db.init_app(app)
 
 
+def upsert(conn, table, rows, key, update=True):
+    """INSERT `rows` into `table`, skipping or updating rows whose `key` exists.
+
+    `key` is a column name, or a tuple of them for a composite key.  Uses
+    ON CONFLICT on PostgreSQL and SQLite; other dialects fall back to
+    delete-then-insert.
+    """
+
+    if not rows:
+        return
+    key = (key,) if isinstance(key, str) else tuple(key)
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif conn.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        key_columns = db.tuple_(*(table.c[col] for col in key))
+        keys = [tuple(row[col] for col in key) for row in rows]
+        if not update:
+            existing = {tuple(r) for r in conn.execute(
+                db.select([table.c[col] for col in key]).where(key_columns.in_(keys)))}
+            rows = [row for row, row_key in zip(rows, keys) if row_key not in existing]
+        else:
+            conn.execute(table.delete().where(key_columns.in_(keys)))
+        if rows:
+            conn.execute(table.insert(), rows)
+        return
+
+    stmt = insert(table).values(rows)
+    if update:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[col] for col in key],
+            set_={col: stmt.excluded[col] for col in rows[0] if col not in key})
+    else:
+        stmt = stmt.on_conflict_do_nothing()
+    conn.execute(stmt)
+
+
 class User(db.Model):
     """User."""
     __tablename__ = 'users'
@@ -37,9 +75,10 @@ class User(db.Model):
     def signup(cls, email, username, password):
         """Sign up user.
         Hashes password and adds user to system.
+        Raises `passwords.HasherBusy` if too many hashes are already queued.
         """
 
-        hashed_pw = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pw = hasher.hash(password)
 
         user = User(
             email=email,
@@ -59,13 +98,21 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+        A password hashed at an outdated cost is rehashed (and committed).
+        Raises `passwords.HasherBusy` if too many hashes are already queued.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.verify(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    try:
+                        user.password = hasher.hash(password)
+                        db.session.commit()
+                    except HasherBusy:
+                        pass  # rehash on a quieter login
                 return user
 
         return False
@@ -87,6 +134,52 @@ class Favorite(db.Model):
     def __repr__(self):
         return f"<Favorite {self.user_id}: {self.poke_name}, {self.timestamp}>"
 
+    @classmethod
+    def is_favorite(cls, user_id, poke_name):
+        """Has user `user_id` favorited `poke_name`?
+
+        One primary key lookup; the user's other favorites are not loaded.
+        """
+
+        return db.session.query(db.exists().where(
+            (cls.user_id == user_id) & (cls.poke_name == poke_name))).scalar()
+
+    @classmethod
+    def toggle(cls, user_id, poke_name):
+        """Favorite or unfavorite `poke_name` for `user_id`; return True if now favorited.
+
+        A single DELETE (... RETURNING on PostgreSQL) removes an existing
+        favorite; if there was none, an INSERT ... ON CONFLICT DO NOTHING adds
+        it, so racing double-clicks never raise on the primary key.  Only the
+        one favorites row is touched.  Runs in the session's transaction; the
+        caller commits.
+        """
+
+        table = cls.__table__
+        match = (table.c.user_id == user_id) & (table.c.poke_name == poke_name)
+        conn = db.session.connection()
+
+        if conn.dialect.name == 'postgresql':
+            removed = conn.execute(
+                table.delete().where(match).returning(table.c.poke_name)).first() is not None
+        else:
+            removed = conn.execute(table.delete().where(match)).rowcount > 0
+        if removed:
+            return False
+
+        row = {'user_id': user_id, 'poke_name': poke_name,
+               'timestamp': datetime.datetime.now()}
+        if conn.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif conn.dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            if not conn.execute(db.select([table.c.user_id]).where(match)).first():
+                conn.execute(table.insert(), [row])
+            return True
+        conn.execute(insert(table).values(row).on_conflict_do_nothing())
+        return True
+
 
 class Pokemon(db.Model):
     """Pokemon."""
@@ -95,5 +188,94 @@ class Pokemon(db.Model):
     name = db.Column(db.Text, primary_key=True, nullable=False, unique=True)
     pokeapi_id = db.Column(db.Integer, nullable=False, unique=True)
 
+    data = db.relationship('PokemonData', uselist=False, passive_deletes=True)
+
     def __repr__(self):
         return f"<Pokemon {self.pokeapi_id}: {self.name}>"
+
+
+class PokemonData(db.Model):
+    """Local catalog copy of the PokeAPI fields the templates use.
+    Filled by `flask pokedex sync` and whenever a pokemon is fetched upstream.
+    """
+    __tablename__ = 'pokemon_data'
+
+    name = db.Column(db.Text, db.ForeignKey('pokemon.name', ondelete='cascade'), primary_key=True)
+    pokeapi_id = db.Column(db.Integer, nullable=False, unique=True)
+    image = db.Column(db.Text, nullable=True)
+    pokedex_img = db.Column(db.Text, nullable=True)
+    pokedex_img_shiny = db.Column(db.Text, nullable=True)
+    types = db.Column(db.JSON, nullable=False)
+    abilities = db.Column(db.JSON, nullable=False)
+    base_xp = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    weight = db.Column(db.Integer, nullable=True)
+    synced_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+
+    def __repr__(self):
+        return f"<PokemonData {self.pokeapi_id}: {self.name}>"
+
+    @staticmethod
+    def row_to_dict(row):
+        """Return a catalog row in the shape of `pokedata.project_pokemon`."""
+
+        return {
+            'id': row.pokeapi_id,
+            'name': row.name,
+            'image': row.image,
+            'pokedex_img': row.pokedex_img,
+            'types': row.types,
+            'base_xp': row.base_xp,
+            'height': row.height,
+            'weight': row.weight,
+            'abilities': row.abilities,
+            'pokedex_img_shiny': row.pokedex_img_shiny,
+        }
+
+    @staticmethod
+    def dict_to_row(pokemon):
+        """Return column values for a `pokedata.project_pokemon` dict."""
+
+        return {
+            'name': pokemon['name'],
+            'pokeapi_id': pokemon['id'],
+            'image': pokemon['image'],
+            'pokedex_img': pokemon['pokedex_img'],
+            'pokedex_img_shiny': pokemon['pokedex_img_shiny'],
+            'types': pokemon['types'],
+            'abilities': pokemon['abilities'],
+            'base_xp': pokemon['base_xp'],
+            'height': pokemon['height'],
+            'weight': pokemon['weight'],
+            'synced_at': datetime.datetime.now(),
+        }
+
+
+class FlavorText(db.Model):
+    """Preprocessed Pokedex flavor texts for one species in one language.
+    Stored under the species name and under any pokemon form name that
+    was used to look it up.
+    """
+    __tablename__ = 'flavor_texts'
+
+    name = db.Column(db.Text, primary_key=True)
+    language = db.Column(db.Text, primary_key=True)
+    texts = db.Column(db.JSON, nullable=False)
+
+    def __repr__(self):
+        return f"<FlavorText {self.name} ({self.language}): {len(self.texts)} texts>"
+
+
+class ApiResponse(db.Model):
+    """Cached PokeAPI response, keyed by upstream url."""
+    __tablename__ = 'api_responses'
+
+    url = db.Column(db.Text, primary_key=True)
+    body = db.Column(db.Text, nullable=False)
+    etag = db.Column(db.Text, nullable=True)
+    last_modified = db.Column(db.Text, nullable=True)
+    fetched_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<ApiResponse {self.url}, expires {self.expires_at}>"
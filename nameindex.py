@@ -0,0 +1,139 @@
+"""In-memory indexes over pokemon names for Pokedex.
+
+Built once per worker from `pokemons.all_pokemon`; lookups never touch the
+database or PokeAPI.
+"""
+
+from bisect import bisect_left
+
+from pokemons import all_pokemon
+
+
+class PrefixIndex:
+    """Sorted-array prefix index: `complete('pik')` -> ['pikachu', ...].
+
+    Names are also indexed under each hyphenated part after the first, so
+    'mime' finds 'mr-mime'.  Matches on the start of the whole name rank
+    first, then the order of `names` (national dex order for
+    `all_pokemon`).
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        rank = {name: i for i, name in enumerate(self.names)}
+        keys = []
+        for name in self.names:
+            keys.append((name, 0, rank[name], name))
+            parts = name.split('-')
+            for i in range(1, len(parts)):
+                keys.append(('-'.join(parts[i:]), 1, rank[name], name))
+        keys.sort()
+        self._keys = [key for key, *rest in keys]
+        self._entries = [(whole, order, name) for key, whole, order, name in keys]
+
+    def __len__(self):
+        return len(self.names)
+
+    def complete(self, prefix, limit=10):
+        """Return up to `limit` names starting with (a part starting with) `prefix`."""
+
+        prefix = prefix.strip().lower().replace(' ', '-')
+        if not prefix or limit <= 0:
+            return []
+        matches = []
+        for i in range(bisect_left(self._keys, prefix), len(self._keys)):
+            if not self._keys[i].startswith(prefix):
+                break
+            matches.append(self._entries[i])
+        matches.sort()
+        results = []
+        for whole, order, name in matches:
+            if name not in results:
+                results.append(name)
+                if len(results) == limit:
+                    break
+        return results
+
+
+def trigrams(word):
+    """Return the set of padded trigrams of `word` ('ab' -> {'  a', ' ab', 'ab '})."""
+
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit=None):
+    """Levenshtein distance between `a` and `b`.
+
+    With `limit`, gives up early and returns `limit + 1` once the distance
+    is known to exceed it.
+    """
+
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    """Typo-tolerant lookup of names.
+
+    Candidates are the names sharing the most trigrams with the query
+    (an inverted index from trigram to names); only those few are ranked
+    by edit distance, which keeps a lookup well under a millisecond for
+    the whole catalog.
+    """
+
+    def __init__(self, names, candidates=16):
+        self.names = list(names)
+        self.candidates = candidates
+        self._known = set(self.names)
+        self._rank = {name: i for i, name in enumerate(self.names)}
+        self._postings = {}  # trigram -> [name]
+        for name in self.names:
+            for gram in trigrams(name):
+                self._postings.setdefault(gram, []).append(name)
+
+    def __contains__(self, name):
+        return name in self._known
+
+    def suggest(self, word, limit=5, max_distance=None):
+        """Return up to `limit` names within `max_distance` edits of `word`, closest first.
+
+        `max_distance` defaults to about a third of the word's length (1-3).
+        """
+
+        word = word.strip().lower().replace(' ', '-')
+        if not word:
+            return []
+        if max_distance is None:
+            max_distance = max(1, min(3, len(word) // 3))
+
+        shared = {}
+        for gram in trigrams(word):
+            for name in self._postings.get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+        candidates = sorted(shared, key=lambda name: -shared[name])[:self.candidates]
+
+        scored = []
+        for name in candidates:
+            distance = edit_distance(word, name, max_distance)
+            if distance <= max_distance:
+                scored.append((distance, self._rank[name], name))
+        scored.sort()
+        return [name for distance, rank, name in scored[:limit]]
+
+
+pokemon_names = PrefixIndex(all_pokemon)
+fuzzy_names = FuzzyIndex(all_pokemon)
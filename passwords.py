@@ -0,0 +1,107 @@
+"""Password hashing for Pokedex.
+
+bcrypt is deliberately slow, so hashing and checking run on a small,
+bounded thread pool (bcrypt releases the GIL while it works) rather than on
+however many request threads happen to be logging in.  The request thread
+still waits for its hash, so the queue limit is what protects the worker:
+with gunicorn's threaded workers (see gunicorn.conf.py) at most QUEUE_LIMIT
+of a worker's threads are ever tied up in password checks, and sign-ins
+past that are turned away with `HasherBusy`, so a login burst can't starve
+ordinary browsing.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+ROUNDS = int(os.environ.get('POKEDEX_BCRYPT_ROUNDS', 12))
+WORKERS = int(os.environ.get('POKEDEX_HASH_WORKERS', 2))
+# Hashes running or waiting at once, per worker; more are rejected.
+# Keep it below the worker's request threads (GUNICORN_THREADS).
+QUEUE_LIMIT = int(os.environ.get('POKEDEX_HASH_QUEUE', 4))
+# Seconds a request waits for a queue slot before it is rejected.
+QUEUE_WAIT = float(os.environ.get('POKEDEX_HASH_QUEUE_WAIT', 0.5))
+
+
+class HasherBusy(Exception):
+    """Too many password hashes are already queued; try again shortly."""
+
+
+def rounds_of(hashed):
+    """Return the work factor of a bcrypt hash ('$2b$12$...' -> 12), or None."""
+
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _require_password(password):
+    if not password:
+        raise ValueError('Password must be non-empty.')
+
+
+class PasswordHasher:
+    """Run bcrypt on a per-worker pool with admission control."""
+
+    def __init__(self, rounds=ROUNDS, workers=WORKERS, queue_limit=QUEUE_LIMIT,
+                 queue_wait=QUEUE_WAIT):
+        self.rounds = rounds
+        self.workers = workers
+        self.queue_wait = queue_wait
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost.
+
+        Raises ValueError for an empty (or None) password, as Flask-Bcrypt did.
+        """
+
+        _require_password(password)
+        return self._run(lambda: bcrypt.hashpw(
+            password.encode('utf-8'), bcrypt.gensalt(self.rounds)).decode('utf-8'))
+
+    def verify(self, hashed, password):
+        """Does `password` match the bcrypt hash `hashed`?"""
+
+        _require_password(password)
+        return self._run(lambda: bcrypt.checkpw(
+            password.encode('utf-8'), hashed.encode('utf-8')))
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made at a different cost than the configured one?"""
+
+        return rounds_of(hashed) != self.rounds
+
+    def stats(self):
+        with self._lock:
+            return {'rounds': self.rounds, 'workers': self.workers,
+                    'rejected': self.rejected}
+
+    def _run(self, fn):
+        if not self._slots.acquire(timeout=self.queue_wait):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy('too many password checks in progress')
+        try:
+            return self._get_executor().submit(fn).result()
+        finally:
+            self._slots.release()
+
+    def _get_executor(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='bcrypt')
+                self._executor_pid = pid
+            return self._executor
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,402 @@
+"""Shared PokeAPI client for Pokedex.
+
+Every upstream call goes through `aget_json`, with timeouts, bounded
+retries and per-endpoint latency counters.  Responses are kept in the
+persistent `apicache`, and a circuit breaker stops calling PokeAPI while it
+is down.  Sync code (the views, CLI commands, background refreshes) uses
+`get_json`, a thin wrapper that runs it on a per-worker background event
+loop with one pooled keep-alive client (`run_sync`).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+import requests
+
+import apicache
+import metrics
+from caching import MISSING, BackgroundRefresher, SingleFlight
+from circuit import CircuitBreaker
+
+# Point at a local stand-in (see standin.py) for tests and benchmarks.
+API_BASE_URL = os.environ.get('POKEAPI_BASE_URL', 'https://pokeapi.co/api/v2').rstrip('/')
+
+CONNECT_TIMEOUT = float(os.environ.get('POKEAPI_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('POKEAPI_READ_TIMEOUT', 10))
+MAX_RETRIES = int(os.environ.get('POKEAPI_MAX_RETRIES', 2))
+BACKOFF_FACTOR = float(os.environ.get('POKEAPI_BACKOFF_FACTOR', 0.3))
+POOL_SIZE = int(os.environ.get('POKEAPI_POOL_SIZE', 20))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+BREAKER_FAILURES = int(os.environ.get('POKEAPI_BREAKER_FAILURES', 5))
+BREAKER_SLOW_CALL = float(os.environ.get('POKEAPI_BREAKER_SLOW_CALL', 2.5))
+BREAKER_RESET = float(os.environ.get('POKEAPI_BREAKER_RESET', 30))
+
+# Separate locks: creating the background client needs the SSL context.
+_ssl_lock = threading.Lock()
+_background_lock = threading.Lock()
+
+_ssl_context = None
+_ssl_context_pid = None
+
+# (loop, its thread, client, pid) for sync callers; see `run_sync`.
+_background = None
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+# Concurrent fetches of one url (from any thread or event loop) share a call.
+_flights = SingleFlight()
+LOCK_POLL = 0.05
+
+# Fails upstream calls fast while PokeAPI is down or too slow.
+breaker = CircuitBreaker(failure_threshold=BREAKER_FAILURES,
+                         slow_call_seconds=BREAKER_SLOW_CALL,
+                         reset_timeout=BREAKER_RESET)
+
+# Revalidates stale cache entries after they have been served.
+_refresher = BackgroundRefresher(int(os.environ.get('POKEAPI_REFRESH_WORKERS', 2)))
+
+
+class UpstreamUnavailable(requests.exceptions.ConnectionError):
+    """PokeAPI was not called because the circuit breaker is open."""
+
+
+def build_url(path):
+    """Return an absolute PokeAPI url for `path` (absolute urls pass through)."""
+
+    if path.startswith('http://') or path.startswith('https://'):
+        return path
+    return f"{API_BASE_URL}/{path.lstrip('/')}"
+
+
+def endpoint_name(url):
+    """Return the resource kind of a PokeAPI url, e.g. 'pokemon-species'."""
+
+    path = url.split('?', 1)[0]
+    if path.startswith(API_BASE_URL):
+        path = path[len(API_BASE_URL):]
+    parts = [part for part in path.split('/') if part]
+    return parts[0] if parts else 'root'
+
+
+def get_json(path):
+    """Sync `aget_json`, run on this worker's background client (see `run_sync`)."""
+
+    return run_sync(lambda client: aget_json(client, path))
+
+
+def _serve_cached(url, kind, cached):
+    """Return the json of a fresh or stale-but-servable entry, or `MISSING`.
+
+    A stale entry is served as is and revalidated in the background; past
+    the stale window the caller has to wait for a fetch.
+    """
+
+    if cached is None:
+        return MISSING
+    if apicache.is_fresh(cached):
+        record_cache_hit(kind)
+        return apicache.decode(cached)
+    if apicache.is_servable(cached):
+        record_cache_hit(kind, stale=True)
+        if not breaker.is_open():
+            _refresher.submit(url, lambda: run_sync(lambda client: _flights.ado(
+                url, lambda: _afetch(client, url, kind, cached))))
+        return apicache.decode(cached)
+    return MISSING
+
+
+def _degraded(url, kind, cached):
+    """Answer a call the breaker refused: any cached body, however old."""
+
+    if cached is None:
+        raise UpstreamUnavailable(f'PokeAPI unavailable, not fetching {url}')
+    record_cache_hit(kind, stale=True)
+    return apicache.decode(cached)
+
+
+def _is_outage(res):
+    """Does this response mean PokeAPI itself is in trouble?"""
+
+    return res.status_code in RETRY_STATUSES
+
+
+##############################################################################
+# ASYNCIO CLIENT
+
+def get_ssl_context():
+    """Return this worker's SSL context for async clients, creating it on first use.
+
+    Loading the CA bundle takes ~20ms, far more than the rest of a client,
+    so the per-request clients share one context.
+    """
+
+    global _ssl_context, _ssl_context_pid
+
+    pid = os.getpid()
+    if _ssl_context is None or _ssl_context_pid != pid:
+        with _ssl_lock:
+            if _ssl_context is None or _ssl_context_pid != pid:
+                _ssl_context = httpx.create_ssl_context()
+                _ssl_context_pid = pid
+    return _ssl_context
+
+
+def async_client():
+    """Return a new `httpx.AsyncClient` with the PokeAPI timeouts and pool.
+
+    A client belongs to the event loop it is used on.  The views don't
+    open one: they go through `run_sync`, whose background loop keeps one
+    client, and so one keep-alive pool, per worker.  Cheap to create:
+    nothing connects until the first call.
+    """
+
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=POOL_SIZE,
+                            max_keepalive_connections=POOL_SIZE),
+        # no transport-level retries: `_aget_with_retries` is the only layer
+        transport=httpx.AsyncHTTPTransport(verify=get_ssl_context()),
+        headers={'Accept': 'application/json'},
+    )
+
+
+async def aget_json(client, path):
+    """GET a PokeAPI resource with `client` and return its decoded json.
+
+    Fresh responses come from the persistent cache (`apicache`); recently
+    expired ones are served stale and revalidated in the background, older
+    ones are revalidated with a conditional request before returning.
+    Concurrent requests for the same url (from any thread or event loop)
+    share one upstream call, so the returned json may be shared between
+    callers and must not be mutated.  429/5xx and timeouts are retried with
+    exponential backoff.
+
+    Raises `requests.exceptions.RequestException` (HTTPError for 4xx/5xx,
+    Timeout, ConnectionError, InvalidJSONError) so callers can treat any
+    upstream problem uniformly.
+    """
+
+    url = build_url(path)
+    kind = endpoint_name(url)
+    cached = await asyncio.to_thread(apicache.lookup, url)
+    data = _serve_cached(url, kind, cached)
+    if data is not MISSING:
+        return data
+
+    return await _flights.ado(url, lambda: _afetch(client, url, kind, cached))
+
+
+async def _afetch(client, url, kind, cached):
+    """Fetch `url` upstream, revalidating `cached` if there is one.
+
+    With shared locks on, only one worker fetches a url at a time; the
+    others wait (up to `apicache.LOCK_WAIT`) for it to land in the cache.
+    While the circuit breaker is open, answers from the cache however old
+    it is, or raises `UpstreamUnavailable` without calling PokeAPI.
+    """
+
+    async with _shared_lock(url) as leader:
+        if not leader:
+            deadline = time.monotonic() + apicache.LOCK_WAIT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL)
+                entry = await asyncio.to_thread(apicache.lookup, url)
+                if entry is not None and apicache.is_fresh(entry):
+                    record_cache_hit(kind)
+                    return apicache.decode(entry)
+
+        if not breaker.allow():
+            return _degraded(url, kind, cached)
+        start = time.perf_counter()
+        try:
+            res = await _aget_with_retries(
+                client, url, apicache.revalidation_headers(cached))
+        except BaseException:
+            # includes cancellation, so a half-open probe is never leaked
+            breaker.record_failure()
+            record_call(kind, time.perf_counter() - start, ok=False)
+            raise
+        seconds = time.perf_counter() - start
+        if _is_outage(res):
+            breaker.record_failure()
+        else:
+            breaker.record_success(seconds)
+
+        try:
+            if res.status_code == 304:
+                record_call(kind, seconds, not_modified=True)
+                await asyncio.to_thread(apicache.touch, url, kind)
+                return apicache.decode(cached)
+            if res.status_code >= 400:
+                raise requests.exceptions.HTTPError(
+                    f'{res.status_code} Error for url: {url}')
+            try:
+                data = res.json()
+            except ValueError as e:
+                raise requests.exceptions.InvalidJSONError(str(e))
+        except requests.exceptions.RequestException:
+            record_call(kind, seconds, ok=False)
+            raise
+        record_call(kind, seconds)
+        await asyncio.to_thread(apicache.store, url, kind, res.text,
+                                res.headers.get('ETag'), res.headers.get('Last-Modified'))
+        return data
+
+
+@asynccontextmanager
+async def _shared_lock(url):
+    """`apicache.shared_lock`, taken and released on a worker thread.
+
+    The response cache is a database, so none of its calls may run on the
+    event loop itself: that would stall every other request on it.
+    """
+
+    lock = apicache.shared_lock(url)
+    leader = await asyncio.to_thread(lock.__enter__)
+    try:
+        yield leader
+    finally:
+        await asyncio.to_thread(lock.__exit__, None, None, None)
+
+
+def run_sync(loader):
+    """Run `loader(client)`, a coroutine function, from sync code and return its result.
+
+    Each worker keeps one event loop on a background thread, with one
+    pooled client, for the views, CLI commands and background refreshes,
+    so they share the async code path and its keep-alive connections.  The caller's context variables (per-request metrics)
+    carry over.  Must not be called from that loop's own thread.
+    """
+
+    loop, thread, client = _get_background()
+    if threading.current_thread() is thread:
+        raise RuntimeError('run_sync called from the background event loop')
+    return asyncio.run_coroutine_threadsafe(loader(client), loop).result()
+
+
+def _get_background():
+    """Return this worker's (loop, thread, client), starting them on first use."""
+
+    global _background
+
+    pid = os.getpid()
+    if _background is None or _background[3] != pid:
+        with _background_lock:
+            if _background is None or _background[3] != pid:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever,
+                                          name='pokeapi-loop', daemon=True)
+                thread.start()
+                _background = (loop, thread, async_client(), pid)
+    return _background[:3]
+
+
+async def _aget_with_retries(client, url, headers):
+    """Fetch `url` with bounded retries, translating httpx errors.
+
+    The only retry layer: timeouts, connection errors and 429/5xx get at
+    most MAX_RETRIES more attempts, so an unreachable PokeAPI costs about
+    (MAX_RETRIES + 1) * CONNECT_TIMEOUT plus backoff per call.  Returns the
+    last response whatever its status; the caller decides what an error
+    status means.
+    """
+
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(BACKOFF_FACTOR * (2 ** (attempt - 1)))
+        try:
+            res = await client.get(url, headers=headers)
+        except httpx.TimeoutException as e:
+            if attempt < MAX_RETRIES:
+                continue
+            raise requests.exceptions.Timeout(str(e))
+        except httpx.NetworkError as e:
+            if attempt < MAX_RETRIES:
+                continue
+            raise requests.exceptions.ConnectionError(str(e))
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+
+        if res.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            continue
+        return res
+
+
+##############################################################################
+# LATENCY COUNTERS
+
+def _counters(endpoint):
+    """Return the counters for `endpoint`; the caller holds `_stats_lock`."""
+
+    return _stats.setdefault(endpoint, {
+        'calls': 0, 'errors': 0, 'not_modified': 0, 'cache_hits': 0,
+        'stale_hits': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+
+
+def record_call(endpoint, seconds, ok=True, not_modified=False):
+    """Add one upstream call to the per-endpoint counters."""
+
+    with _stats_lock:
+        entry = _counters(endpoint)
+        entry['calls'] += 1
+        if not ok:
+            entry['errors'] += 1
+        if not_modified:
+            entry['not_modified'] += 1
+        entry['total_seconds'] += seconds
+        entry['max_seconds'] = max(entry['max_seconds'], seconds)
+    outcome = 'error' if not ok else 'not_modified' if not_modified else 'ok'
+    metrics.record_upstream(endpoint, seconds, outcome)
+
+
+def record_cache_hit(endpoint, stale=False):
+    """Count a response served from the persistent cache."""
+
+    with _stats_lock:
+        _counters(endpoint)['stale_hits' if stale else 'cache_hits'] += 1
+    metrics.record_cache_hit(endpoint, stale)
+
+
+def stats():
+    """Return a snapshot of the per-endpoint latency counters."""
+
+    with _stats_lock:
+        return {endpoint: dict(entry) for endpoint, entry in _stats.items()}
+
+
+def flight_stats():
+    """Return how many upstream calls were coalesced by single-flight."""
+
+    return _flights.stats()
+
+
+def breaker_stats():
+    """Return the circuit breaker state and counters."""
+
+    return breaker.stats()
+
+
+def degraded():
+    """Is PokeAPI currently being skipped by the circuit breaker?"""
+
+    return breaker.is_open()
+
+
+def refresh_stats():
+    """Return the background revalidation counters."""
+
+    return _refresher.stats()
+
+
+def reset_stats():
+    """Clear the latency counters (useful for tests and benchmarks)."""
+
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,645 @@
+"""PokeAPI data helpers for Pokedex.
+
+These turn raw PokeAPI json into the small dicts the templates use.  The
+loaders that fetch are async (`afetch_many`, `aload_pokemon_details`, ...);
+their sync counterparts are thin wrappers that run them with
+`pokeapi.run_sync`.
+"""
+
+import asyncio
+import os
+import random
+
+import requests
+
+import catalog
+from caching import MISSING, BackgroundRefresher, SingleFlight, TTLCache
+from filterindex import FilterIndex
+from pokeapi import aget_json, get_json, run_sync
+from pokemons import all_pokemon
+
+BLURB_ERROR = "Sorry, there was an error fetching the blurb for this pokemon."
+
+PAGE_CONCURRENCY = int(os.environ.get('POKEDEX_PAGE_CONCURRENCY', 8))
+PAGE_DEADLINE = float(os.environ.get('POKEDEX_PAGE_DEADLINE', 8))
+
+CACHE_MAX_ENTRIES = int(os.environ.get('POKEDEX_CACHE_MAX_ENTRIES', 2048))
+CACHE_MAX_BYTES = int(os.environ.get('POKEDEX_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+CACHE_TTL = float(os.environ.get('POKEDEX_CACHE_TTL', 6 * 60 * 60))
+COUNT_TTL = float(os.environ.get('POKEDEX_COUNT_TTL', 24 * 60 * 60))
+# Seconds past CACHE_TTL an entry is still served while it is refreshed in
+# the background; after that a request waits for the refresh.
+STALE_WINDOW = float(os.environ.get('POKEDEX_STALE_WINDOW', 24 * 60 * 60))
+REFRESH_WORKERS = int(os.environ.get('POKEDEX_REFRESH_WORKERS', 2))
+# Seconds before a worker rebuilds its filter index from the catalog (it is
+# served stale, for STALE_WINDOW, while the rebuild runs in the background).
+FILTER_INDEX_TTL = float(os.environ.get('POKEDEX_FILTER_INDEX_TTL', 10 * 60))
+PINNED_POKEMON = [name.strip() for name in os.environ.get(
+    'POKEDEX_PINNED_POKEMON', 'pikachu,charizard').split(',') if name.strip()]
+
+# Projected dicts only (never raw PokeAPI json), per worker.
+pokemon_cache = TTLCache(max_entries=CACHE_MAX_ENTRIES,
+                         max_bytes=CACHE_MAX_BYTES,
+                         ttl=CACHE_TTL,
+                         stale_ttl=STALE_WINDOW,
+                         pinned=PINNED_POKEMON)
+# Evolution chains by chain id: {'id', 'names', 'members'}, where members
+# are the projected dicts of every pokemon in the chain.
+chain_cache = TTLCache(max_entries=CACHE_MAX_ENTRIES,
+                       max_bytes=CACHE_MAX_BYTES // 2,
+                       ttl=CACHE_TTL,
+                       stale_ttl=STALE_WINDOW)
+# Species (and pokemon) name -> {language: [flavor texts]}.
+flavor_cache = TTLCache(max_entries=CACHE_MAX_ENTRIES,
+                        max_bytes=CACHE_MAX_BYTES // 2,
+                        ttl=CACHE_TTL,
+                        stale_ttl=STALE_WINDOW,
+                        pinned=PINNED_POKEMON)
+# Species (and pokemon) name -> evolution chain id.
+chain_index = TTLCache(max_entries=CACHE_MAX_ENTRIES * 2,
+                       ttl=CACHE_TTL,
+                       stale_ttl=STALE_WINDOW,
+                       pinned=PINNED_POKEMON)
+count_cache = TTLCache(max_entries=1, ttl=COUNT_TTL)
+# The whole catalog as a `FilterIndex`, for type/ability/stat searches.
+filter_cache = TTLCache(max_entries=1, ttl=FILTER_INDEX_TTL, stale_ttl=STALE_WINDOW)
+_filter_builds = SingleFlight()
+
+# Refreshes stale cache entries after they have been served.
+refresher = BackgroundRefresher(REFRESH_WORKERS)
+
+
+##############################################################################
+# PROJECTIONS
+
+def project_pokemon(data):
+    """Return the fields the templates need from a `/pokemon/<name>` payload."""
+
+    return {
+        'id': data['id'],
+        'name': data['name'],
+        'image': data['sprites']['other']['official-artwork']['front_default'],
+        'pokedex_img': data['sprites']['front_default'],
+        'types': data['types'],
+        'base_xp': data['base_experience'],
+        'height': data['height'],
+        'weight': data['weight'],
+        'abilities': data['abilities'],
+        'pokedex_img_shiny': data['sprites']['front_shiny'],
+    }
+
+
+def evolution_names(evolution_chain):
+    """Flatten an evolution chain into a list of species names."""
+
+    names = []
+
+    def get_evolution_names(evolution_chain):
+        """Extracts evolution names from returned data"""
+        # get current evolution name
+        names.append(evolution_chain['species']['name'])
+        # get the names of any evolutions that come after the current one
+        for evolution in evolution_chain['evolves_to']:
+            get_evolution_names(evolution)
+
+    get_evolution_names(evolution_chain)
+
+    return names
+
+
+def flavor_texts_by_language(species):
+    """Group a species payload's flavor texts as {language: [texts]}.
+
+    Whitespace (PokeAPI uses form feeds and hard line breaks) is normalised
+    and repeated texts from different games are dropped.
+    """
+
+    by_language = {}
+    for entry in species['flavor_text_entries']:
+        text = ' '.join(entry['flavor_text'].split())
+        texts = by_language.setdefault(entry['language']['name'], [])
+        if text not in texts:
+            texts.append(text)
+    return by_language
+
+
+def choose_language(available, languages):
+    """Return the first of `languages` (e.g. from Accept-Language) in `available`.
+
+    Matching is case-insensitive and falls back to the primary subtag, so
+    'en-US' matches 'en'.  Falls back to English, then to any language.
+    """
+
+    lookup = {language.lower(): language for language in available}
+    for language in languages:
+        language = language.lower()
+        if language in lookup:
+            return lookup[language]
+        primary = language.split('-', 1)[0]
+        if primary in lookup:
+            return lookup[primary]
+    if 'en' in available:
+        return 'en'
+    return next(iter(available), None)
+
+
+def pick_blurb(texts, languages):
+    """Return a random flavor text from {language: [texts]} in the best language."""
+
+    if isinstance(languages, str):
+        languages = [languages]
+    language = choose_language(texts, languages)
+    if language is None:
+        return BLURB_ERROR
+    return random.choice(texts[language])
+
+
+##############################################################################
+# SINGLE-RESOURCE HELPERS
+
+def cache_stats():
+    """Return hit/miss/eviction counters for this worker's caches."""
+
+    return {
+        'pokemon': pokemon_cache.stats(),
+        'chains': chain_cache.stats(),
+        'chain_index': chain_index.stats(),
+        'flavor_texts': flavor_cache.stats(),
+        'count': count_cache.stats(),
+        'filter_index': filter_cache.stats(),
+        'refreshes': refresher.stats(),
+    }
+
+
+def total_pokemon():
+    """Return the total number of pokemon, without calling PokeAPI.
+
+    Uses the last count PokeAPI reported (see `remember_total`), falling
+    back to the larger of the catalog size and the bundled name list.
+    """
+
+    count = count_cache.get('count')
+    if count is MISSING:
+        count = max(catalog.count(), len(all_pokemon))
+        count_cache.set('count', count)
+    return count
+
+
+def remember_total(count):
+    """Keep the total PokeAPI reports on a list page for `total_pokemon`."""
+
+    count_cache.set('count', count)
+
+
+def filter_index():
+    """Return this worker's `FilterIndex` over the catalog.
+
+    Built on first use (concurrent requests share one build) and rebuilt
+    in the background once it is older than FILTER_INDEX_TTL.  An empty
+    catalog isn't cached, so a sync shows up on the next request.
+    """
+
+    index, stale = filter_cache.peek('index')
+    if index is MISSING:
+        index = _filter_builds.do('index', _build_filter_index)
+    elif stale:
+        refresher.submit(('filter_index',), _build_filter_index)
+    return index
+
+
+def _build_filter_index():
+    index = FilterIndex(catalog.load_all())
+    if len(index):
+        filter_cache.set('index', index)
+    return index
+
+
+def remember_pokemon(pokemon_name, data):
+    """Project a `/pokemon/<name>` payload, cache it and save it to the catalog."""
+
+    pokemon = project_pokemon(data)
+    pokemon_cache.set(pokemon_name, pokemon)
+    catalog.save([pokemon])
+    return pokemon
+
+
+def local_pokemon(pokemon_names):
+    """Return data for each of `pokemon_names` without calling PokeAPI.
+
+    Checks the in-process cache, then the catalog (one query for all
+    misses); names found nowhere come back as `MISSING`.  Stale cache
+    entries are returned as they are and refreshed in the background.
+    """
+
+    found = []
+    for name in pokemon_names:
+        pokemon, stale = pokemon_cache.peek(name)
+        if stale:
+            refresher.submit(('pokemon', name), lambda name=name: remember_pokemon(
+                name, get_json(f'pokemon/{name}')))
+        found.append(pokemon)
+    misses = [name for name, pokemon in zip(pokemon_names, found)
+              if pokemon is MISSING]
+    if not misses:
+        return found
+
+    stored = catalog.lookup_many(misses)
+    for name, pokemon in stored.items():
+        pokemon_cache.set(name, pokemon)
+    return [stored.get(name, MISSING) if pokemon is MISSING else pokemon
+            for name, pokemon in zip(pokemon_names, found)]
+
+
+def fetch_pokemon_data(pokemon_name):
+    """Return data for the given pokemon from the local catalog or PokeApi."""
+
+    pokemon, = local_pokemon([pokemon_name])
+    if pokemon is MISSING:
+        pokemon = run_sync(lambda client: afetch_pokemon_data(client, pokemon_name))
+    return pokemon
+
+
+def fetch_evolutions(pokemon_name):
+    """Return a pokemon's evolutions (if exists) for given search term.
+        Not every pokemon will have more than one evolution, so a catch/error accounts for that.
+    """
+
+    chain = cached_chain(pokemon_name)
+    if chain is MISSING:
+        chain = run_with_fetcher(_aload_chain_of, pokemon_name)
+    return chain['names'] if chain else [pokemon_name]
+
+
+def fetch_blurb(pokemon_name, language):
+    """Generates a random fact in the specified language about the pokemon.
+        `language` may also be a list of languages in order of preference.
+    """
+
+    texts = local_flavor_texts(pokemon_name)
+    if texts is MISSING:
+        texts = remember_flavor_texts(
+            pokemon_name, run_with_fetcher(_aload_species, pokemon_name))
+    return pick_blurb(texts, language)
+
+
+def local_flavor_texts(pokemon_name):
+    """Return {language: [texts]} for `pokemon_name` without calling PokeAPI.
+
+    Checks the in-process cache, then the flavor text store; returns
+    `MISSING` if neither has it.  A stale cache entry is returned as it is
+    and reloaded in the background.
+    """
+
+    texts, stale = flavor_cache.peek(pokemon_name)
+    if stale:
+        refresher.submit(('flavor_texts', pokemon_name),
+                         lambda: _refresh_flavor_texts(pokemon_name))
+    if texts is MISSING:
+        texts = catalog.flavor_texts(pokemon_name)
+        if texts is None:
+            return MISSING
+        flavor_cache.set(pokemon_name, texts)
+    return texts
+
+
+def _refresh_flavor_texts(pokemon_name):
+    """Reload flavor texts from the store, or PokeAPI if they are not there."""
+
+    texts = catalog.flavor_texts(pokemon_name)
+    if texts is None:
+        remember_flavor_texts(pokemon_name,
+                              run_with_fetcher(_aload_species, pokemon_name))
+    else:
+        flavor_cache.set(pokemon_name, texts)
+
+
+def remember_flavor_texts(pokemon_name, species):
+    """Preprocess a species payload's flavor texts, cache and store them.
+
+    Returns {} (which `pick_blurb` turns into the error blurb) if the
+    species could not be loaded.
+    """
+
+    try:
+        texts = flavor_texts_by_language(species)
+    except (KeyError, TypeError):
+        return {}
+    names = {pokemon_name, species.get('name', pokemon_name)}
+    for name in names:
+        flavor_cache.set(name, texts)
+    catalog.save_flavor_texts({name: texts for name in names})
+    return texts
+
+
+def fetch_many(pokemon_names, concurrency=None, deadline=None):
+    """Sync `afetch_many`."""
+
+    return run_sync(lambda client: afetch_many(client, pokemon_names, concurrency, deadline))
+
+
+def fetch_favorites(user_id, limit, offset=0):
+    """Sync `afetch_favorites`."""
+
+    return run_sync(lambda client: afetch_favorites(client, user_id, limit, offset))
+
+
+##############################################################################
+# EVOLUTION CHAINS
+#   Every member of a chain shares one cached entry, so after the first
+#   lookup bulbasaur, ivysaur and venusaur are all served locally.
+
+def chain_id_from_url(url):
+    """Return the id from an `/evolution-chain/<id>/` url."""
+
+    return int(url.rstrip('/').rsplit('/', 1)[1])
+
+
+def cached_chain(pokemon_name):
+    """Return the cached evolution chain for `pokemon_name`, or `MISSING`.
+
+    A stale chain is returned as it is and reloaded in the background.
+    """
+
+    chain_id, stale_id = chain_index.peek(pokemon_name)
+    if chain_id is MISSING:
+        return MISSING
+    chain, stale = chain_cache.peek(chain_id)
+    if chain is not MISSING and (stale or stale_id):
+        refresher.submit(('chain', chain_id),
+                         lambda: _refresh_chain(pokemon_name))
+    return chain
+
+
+def _refresh_chain(pokemon_name):
+    """Reload the evolution chain containing `pokemon_name` from PokeAPI."""
+
+    run_with_fetcher(_aload_chain_of, pokemon_name)
+
+
+def remember_chain(chain_id, names, members, aliases=()):
+    """Cache an evolution chain and index it under every member's name."""
+
+    chain = {'id': chain_id, 'names': names, 'members': members}
+    chain_cache.set(chain_id, chain)
+    for name in (*names, *aliases):
+        chain_index.set(name, chain_id)
+    return chain
+
+
+def _chain_url(species):
+    """Return (chain_id, url) for a species payload, or (None, None)."""
+
+    try:
+        url = species['evolution_chain']['url']
+        return chain_id_from_url(url), url
+    except (KeyError, TypeError, ValueError) as e:
+        print(f'Error fetching evolution data: {e}')
+        return None, None
+
+
+##############################################################################
+# DETAIL PAGE LOADER
+
+def load_pokemon_details(pokemon_name, language='en'):
+    """Sync `aload_pokemon_details`."""
+
+    return run_sync(lambda client: aload_pokemon_details(client, pokemon_name, language))
+
+
+##############################################################################
+# LOADERS
+#   Each takes an httpx client, normally the worker's background client via
+#   `run_sync` (which is how the views call them).  None of them return with
+#   a fetch still running on the client, which would fail if the caller
+#   closed it.  Catalog reads and writes go through `asyncio.to_thread`: a
+#   blocking database call on the event loop would stall every request on it.
+
+async def cancel_tasks(tasks):
+    """Cancel whichever of `tasks` are still running and wait for them to stop."""
+
+    tasks = list(tasks)
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def afetch_pokemon_data(client, pokemon_name):
+    """Return data for the given pokemon from the local catalog or PokeAPI."""
+
+    pokemon, = await asyncio.to_thread(local_pokemon, [pokemon_name])
+    if pokemon is MISSING:
+        pokemon = await asyncio.to_thread(
+            remember_pokemon, pokemon_name, await aget_json(client, f'pokemon/{pokemon_name}'))
+    return pokemon
+
+
+async def afetch_many(client, pokemon_names, concurrency=None, deadline=None):
+    """Return data for each of `pokemon_names`, fetched concurrently.
+
+    At most `concurrency` fetches are in flight at once and the whole batch
+    gets `deadline` seconds.  Results keep the order of `pokemon_names`;
+    a pokemon that fails or misses the deadline is left out rather than
+    failing the whole batch.
+    """
+
+    concurrency = concurrency or PAGE_CONCURRENCY
+    deadline = PAGE_DEADLINE if deadline is None else deadline
+    gate = asyncio.Semaphore(concurrency)
+
+    async def fetch(name):
+        async with gate:
+            return await asyncio.to_thread(
+                remember_pokemon, name, await aget_json(client, f'pokemon/{name}'))
+
+    cached = await asyncio.to_thread(local_pokemon, pokemon_names)
+    tasks = {name: asyncio.ensure_future(fetch(name))
+             for name, pokemon in zip(pokemon_names, cached) if pokemon is MISSING}
+    done = set()
+    try:
+        if tasks:
+            done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    finally:
+        await cancel_tasks(tasks.values())
+
+    pokemon_data = []
+    for name, pokemon in zip(pokemon_names, cached):
+        if pokemon is not MISSING:
+            pokemon_data.append(pokemon)
+            continue
+        task = tasks[name]
+        if task not in done:
+            print(f'Timed out fetching pokemon data: {name}')
+        elif task.exception() is not None:
+            print(f'Error fetching pokemon data for {name}: {task.exception()}')
+        else:
+            pokemon_data.append(task.result())
+
+    return pokemon_data
+
+
+async def afetch_favorites(client, user_id, limit, offset=0):
+    """Return (total, [pokemon data]) for one page of a user's favorites.
+
+    The page comes from one catalog query; only favorites missing from the
+    catalog are fetched, together, with `afetch_many`.  Ones that still
+    cannot be loaded are left out.
+    """
+
+    total, rows = await asyncio.to_thread(catalog.favorites_page, user_id, limit, offset)
+    missing = [name for name, pokemon in rows if pokemon is None]
+    fetched = {}
+    if missing:
+        fetched = {pokemon['name']: pokemon
+                   for pokemon in await afetch_many(client, missing)}
+    favorites = [pokemon if pokemon is not None else fetched.get(name)
+                 for name, pokemon in rows]
+    return total, [pokemon for pokemon in favorites if pokemon is not None]
+
+
+class RequestFetcher:
+    """Request-scoped `aget_json` that fetches each url at most once.
+
+    Concurrent lookups of the same url share one task, so the pokemon,
+    species and evolution chain are downloaded once per page view no
+    matter how many helpers need them.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._tasks = {}
+
+    def submit(self, path):
+        """Start fetching `path` (if not already started); return its task."""
+
+        task = self._tasks.get(path)
+        if task is None:
+            task = asyncio.ensure_future(aget_json(self.client, path))
+            self._tasks[path] = task
+        return task
+
+    async def get(self, path):
+        """Return the json for `path`, waiting for it if necessary."""
+
+        return await self.submit(path)
+
+    async def aclose(self):
+        """Cancel any fetch nobody waited for (e.g. the species of a missing pokemon)."""
+
+        await cancel_tasks(self._tasks.values())
+
+
+async def aload_pokemon_details(client, pokemon_name, language='en'):
+    """Return (pokemon_data, blurb, evolutions_data) for the details page.
+
+    `/pokemon/<name>` and `/pokemon-species/<name>` are fetched together
+    (the species name matches the pokemon name for default forms), then the
+    evolution chain, then every chain member concurrently.  Anything already
+    in the pokemon/chain/flavor text caches or the catalog is not fetched at
+    all, so a warm page makes no upstream calls.  `language` may be a list
+    of languages in order of preference.  Raises
+    `requests.exceptions.RequestException` if the pokemon itself is missing.
+    """
+
+    fetcher = RequestFetcher(client)
+    try:
+        return await _aload_pokemon_details(fetcher, pokemon_name, language)
+    finally:
+        await fetcher.aclose()
+
+
+def run_with_fetcher(loader, *args):
+    """Run `loader(fetcher, *args)` from sync code with a fresh `RequestFetcher`."""
+
+    async def run(client):
+        fetcher = RequestFetcher(client)
+        try:
+            return await loader(fetcher, *args)
+        finally:
+            await fetcher.aclose()
+
+    return run_sync(run)
+
+
+async def _aload_pokemon_details(fetcher, pokemon_name, language):
+    pokemon_data, = await asyncio.to_thread(local_pokemon, [pokemon_name])
+    texts = await asyncio.to_thread(local_flavor_texts, pokemon_name)
+    chain = cached_chain(pokemon_name)
+    need_species = texts is MISSING or chain is MISSING
+
+    if pokemon_data is MISSING:
+        fetcher.submit(f'pokemon/{pokemon_name}')
+    if need_species:
+        fetcher.submit(f'pokemon-species/{pokemon_name}')
+
+    if pokemon_data is MISSING:
+        pokemon_data = await asyncio.to_thread(
+            remember_pokemon, pokemon_name, await fetcher.get(f'pokemon/{pokemon_name}'))
+    if need_species:
+        species = await _aload_species(fetcher, pokemon_name)
+        if texts is MISSING:
+            texts = await asyncio.to_thread(remember_flavor_texts, pokemon_name, species)
+        if chain is MISSING:
+            chain = await _aload_chain(fetcher, species, pokemon_name)
+
+    blurb = pick_blurb(texts, language)
+
+    if chain and len(chain['names']) > 1:
+        evolutions_data = chain['members']
+    else:
+        evolutions_data = [pokemon_data]
+
+    return pokemon_data, blurb, evolutions_data
+
+
+async def _aload_species(fetcher, pokemon_name):
+    """Return the species payload for `pokemon_name`, or {} if unavailable.
+
+    Falls back to the species url from the pokemon payload for alternate
+    forms whose species name differs (e.g. 'deoxys-normal' -> 'deoxys').
+    """
+
+    try:
+        return await fetcher.get(f'pokemon-species/{pokemon_name}')
+    except requests.exceptions.RequestException:
+        pass
+    try:
+        pokemon = await fetcher.get(f'pokemon/{pokemon_name}')
+        return await fetcher.get(pokemon['species']['url'])
+    except requests.exceptions.RequestException as e:
+        print(f'Error fetching species data: {e}')
+        return {}
+
+
+async def _aload_chain(fetcher, species, pokemon_name):
+    """Return the evolution chain for a species payload, or None.
+
+    Fetches the chain and any members missing locally, and caches the
+    result only when every member could be loaded.
+    """
+
+    chain_id, url = _chain_url(species)
+    if chain_id is None:
+        return None
+    chain = chain_cache.get(chain_id)
+    if chain is not MISSING:
+        chain_index.set(pokemon_name, chain_id)
+        return chain
+
+    try:
+        names = evolution_names((await fetcher.get(url))['chain'])
+    except (requests.exceptions.RequestException, KeyError) as e:
+        print(f'Error fetching evolution data: {e}')
+        return None
+
+    members = await afetch_many(fetcher.client, names)
+    if len(members) < len(names):
+        return {'id': chain_id, 'names': names, 'members': members}
+    return remember_chain(chain_id, names, members, aliases=[pokemon_name])
+
+
+async def _aload_chain_of(fetcher, pokemon_name):
+    """Return the evolution chain containing `pokemon_name`, or None."""
+
+    return await _aload_chain(fetcher, await _aload_species(fetcher, pokemon_name),
+                              pokemon_name)
@@ -0,0 +1,108 @@
+"""Per-request SQL query profiler for Pokedex.
+
+Replaces SQLALCHEMY_ECHO in production.  Every statement slower than
+POKEDEX_SQL_SLOW_MS is logged.  A POKEDEX_SQL_PROFILE_RATE fraction of
+requests is profiled in full: the number of queries and total DB time are
+logged, and so is any statement run POKEDEX_SQL_REPEAT_THRESHOLD or more
+times, which usually means an N+1 lazy load (e.g. `g.user.favorites`
+touched once per pokemon).
+"""
+
+import os
+import random
+import time
+from contextvars import ContextVar
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+SAMPLE_RATE = float(os.environ.get('POKEDEX_SQL_PROFILE_RATE', 0.05))
+SLOW_QUERY_MS = float(os.environ.get('POKEDEX_SQL_SLOW_MS', 100))
+REPEAT_THRESHOLD = int(os.environ.get('POKEDEX_SQL_REPEAT_THRESHOLD', 3))
+
+
+def summarize(statement, length=200):
+    """Return `statement` on one line, cut to `length` characters."""
+
+    statement = ' '.join(statement.split())
+    if len(statement) > length:
+        statement = statement[:length - 3] + '...'
+    return statement
+
+
+class QueryProfile:
+    """The statements one request ran, with counts and time."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = {}  # statement -> [count, seconds]
+
+    def add(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        entry = self.statements.setdefault(statement, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def repeated(self, threshold=REPEAT_THRESHOLD):
+        """Return [(statement, count, seconds)] run at least `threshold` times."""
+
+        found = [(statement, count, seconds)
+                 for statement, (count, seconds) in self.statements.items()
+                 if count >= threshold]
+        found.sort(key=lambda entry: entry[1], reverse=True)
+        return found
+
+
+_profile = ContextVar('pokedex_query_profile', default=None)
+
+
+def init_app(app, sample_rate=None):
+    """Profile a sample of `app`'s requests and log slow statements."""
+
+    app.config.setdefault('SQL_PROFILE_RATE', SAMPLE_RATE if sample_rate is None else sample_rate)
+    app.before_request(_start_request)
+    app.teardown_request(_finish_request)
+    if not event.contains(Engine, 'before_cursor_execute', _start_query):
+        event.listen(Engine, 'before_cursor_execute', _start_query)
+        event.listen(Engine, 'after_cursor_execute', _finish_query)
+
+
+def _start_request():
+    if random.random() < current_app.config['SQL_PROFILE_RATE']:
+        g.query_profile_token = _profile.set(QueryProfile())
+
+
+def _finish_request(exception=None):
+    token = g.pop('query_profile_token', None)
+    if token is None:
+        return
+    profile = _profile.get()
+    _profile.reset(token)
+
+    route = request.endpoint or 'unmatched'
+    print(f'SQL {request.method} {request.path}: {profile.queries} queries '
+          f'in {profile.seconds * 1000:.1f}ms')
+    repeated = profile.repeated()
+    for statement, count, seconds in repeated:
+        print(f'Possible N+1 in {route}: {count} x {summarize(statement)} '
+              f'({seconds * 1000:.1f}ms)')
+    if repeated:
+        metrics.record_repeated_queries(route)
+
+
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+
+def _finish_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['profile_start'].pop()
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        print(f'Slow query ({seconds * 1000:.0f}ms): {summarize(statement)}')
+    profile = _profile.get()
+    if profile is not None:
+        profile.add(statement, seconds)
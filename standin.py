@@ -0,0 +1,309 @@
+"""Local PokeAPI stand-in for tests and offline benchmarks.
+
+Replays recorded `/pokemon`, `/pokemon-species` and `/evolution-chain`
+responses from `fixtures/pokeapi/<kind>/<name or id>.json`, with optional
+latency, jitter, slow calls and errors so slow-upstream incidents can be
+reproduced.  Point the app at it with POKEAPI_BASE_URL.  Only uses the
+standard library, so it runs without the app's dependencies.
+
+run it like:
+
+    python standin.py serve --port 8001 --latency 0.05 --jitter 0.02 --error-rate 0.01
+    POKEAPI_BASE_URL=http://127.0.0.1:8001/api/v2 flask run
+
+record more fixtures (a pokemon plus its species and whole evolution chain):
+
+    python standin.py record pikachu bulbasaur
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+UPSTREAM_URL = 'https://pokeapi.co/api/v2'
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'fixtures', 'pokeapi')
+API_PREFIX = '/api/v2'
+
+
+class Fixtures:
+    """Recorded response bodies, by resource kind and name (or id)."""
+
+    def __init__(self, directory=FIXTURES_DIR):
+        self.directory = directory
+        self._bodies = {}  # (kind, key) -> body text
+        self._index = {}   # kind -> [(id, name)] sorted by id
+        self.load()
+
+    def load(self):
+        """(Re)read every fixture file under `directory`."""
+
+        bodies, index = {}, {}
+        if os.path.isdir(self.directory):
+            for kind in sorted(os.listdir(self.directory)):
+                kind_dir = os.path.join(self.directory, kind)
+                if not os.path.isdir(kind_dir):
+                    continue
+                for filename in sorted(os.listdir(kind_dir)):
+                    if not filename.endswith('.json'):
+                        continue
+                    with open(os.path.join(kind_dir, filename), encoding='utf-8') as f:
+                        body = f.read()
+                    data = json.loads(body)
+                    key = filename[:-len('.json')]
+                    bodies[(kind, key)] = body
+                    if 'id' in data:
+                        bodies[(kind, str(data['id']))] = body
+                        index.setdefault(kind, []).append(
+                            (data['id'], data.get('name', key)))
+        for entries in index.values():
+            entries.sort()
+        self._bodies, self._index = bodies, index
+
+    def get(self, kind, key):
+        """Return the recorded body for `kind`/`key`, or None."""
+
+        return self._bodies.get((kind, str(key).lower()))
+
+    def listing(self, kind, limit=20, offset=0):
+        """Return a PokeAPI-style paginated list of the recorded `kind`."""
+
+        entries = self._index.get(kind, [])
+        page = entries[offset:offset + limit]
+        return {
+            'count': len(entries),
+            'next': None,
+            'previous': None,
+            'results': [{'name': name, 'url': f'{UPSTREAM_URL}/{kind}/{id}/'}
+                        for id, name in page],
+        }
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded HTTP server replaying `fixtures` with injected faults.
+
+    Every response waits `latency` plus up to `jitter` seconds; a
+    `slow_rate` fraction of calls waits `slow_latency` instead, and an
+    `error_rate` fraction answers `error_status`.  `calls` counts the
+    requests served, by kind.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, latency=0, jitter=0, error_rate=0,
+                 error_status=503, slow_rate=0, slow_latency=5, seed=None):
+        super().__init__(address, StandInHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.random = random.Random(seed)
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        """Base url to use as POKEAPI_BASE_URL."""
+
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{API_PREFIX}'
+
+    def count_call(self, kind):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def delay(self):
+        """Return how long this response should take, and whether to fail it."""
+
+        with self._lock:
+            roll = self.random.random()
+            slow = self.random.random() < self.slow_rate
+            jitter = self.random.uniform(0, self.jitter) if self.jitter else 0
+        seconds = self.slow_latency if slow else self.latency + jitter
+        return seconds, roll < self.error_rate
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answer GET requests the way PokeAPI would, from the fixtures."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+        kind, _, key = path.strip('/').partition('/')
+        self.server.count_call(kind or 'root')
+
+        seconds, fail = self.server.delay()
+        if seconds:
+            time.sleep(seconds)
+        if fail:
+            self.send_json(self.server.error_status, '{"detail": "Injected error."}')
+            return
+
+        if key:
+            body = self.server.fixtures.get(kind, key)
+        else:
+            query = parse_qs(url.query)
+            body = json.dumps(self.server.fixtures.listing(
+                kind,
+                limit=int(query.get('limit', [20])[0]),
+                offset=int(query.get('offset', [0])[0])))
+        if body is None:
+            self.send_json(404, '{"detail": "Not found."}')
+            return
+
+        # Recorded bodies link to the real API; keep follow-up calls here.
+        body = body.replace(UPSTREAM_URL, self.server.base_url)
+        etag = '"' + hashlib.md5(body.encode()).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_json(200, body, etag)
+
+    def send_json(self, status, body, etag=None):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(fixtures_dir=FIXTURES_DIR, host='127.0.0.1', port=0, **faults):
+    """Start a stand-in server in a background thread and return it.
+
+    `port=0` picks a free port; use `server.base_url` to reach it and
+    `server.shutdown()` to stop it.
+    """
+
+    server = StandInServer((host, port), Fixtures(fixtures_dir), **faults)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+##############################################################################
+# RECORDING
+
+def _download(url):
+    request = urllib.request.Request(url, headers={'Accept': 'application/json',
+                                                   'User-Agent': 'pokedex-standin'})
+    with urllib.request.urlopen(request, timeout=30) as res:
+        return res.read().decode()
+
+
+def _save(fixtures_dir, kind, key, body):
+    kind_dir = os.path.join(fixtures_dir, kind)
+    os.makedirs(kind_dir, exist_ok=True)
+    with open(os.path.join(kind_dir, f'{key}.json'), 'w', encoding='utf-8') as f:
+        f.write(body)
+
+
+def record(names, fixtures_dir=FIXTURES_DIR, upstream=UPSTREAM_URL):
+    """Record each pokemon in `names` with its species and evolution chain.
+
+    Every member of the chain is recorded too, so details pages replay
+    without gaps.  Returns the number of files written.
+    """
+
+    written = 0
+    pending, seen, chains = list(names), set(), set()
+    while pending:
+        name = pending.pop(0).lower()
+        if name in seen:
+            continue
+        seen.add(name)
+        try:
+            pokemon_body = _download(f'{upstream}/pokemon/{name}')
+        except urllib.error.HTTPError as e:
+            print(f'Error recording pokemon {name}: {e}')
+            continue
+        pokemon = json.loads(pokemon_body)
+        _save(fixtures_dir, 'pokemon', pokemon['name'], pokemon_body)
+
+        species_body = _download(pokemon['species']['url'])
+        species = json.loads(species_body)
+        _save(fixtures_dir, 'pokemon-species', species['name'], species_body)
+
+        written += 2
+
+        chain_url = species['evolution_chain']['url']
+        if chain_url in chains:
+            continue
+        chains.add(chain_url)
+        chain_body = _download(chain_url)
+        chain = json.loads(chain_body)
+        _save(fixtures_dir, 'evolution-chain', chain['id'], chain_body)
+        written += 1
+
+        stack = [chain['chain']]
+        while stack:
+            link = stack.pop()
+            pending.append(link['species']['name'])
+            stack.extend(link['evolves_to'])
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='replay the fixtures over HTTP')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8001)
+    serve.add_argument('--latency', type=float, default=0,
+                       help='seconds added to every response')
+    serve.add_argument('--jitter', type=float, default=0,
+                       help='up to this many extra random seconds per response')
+    serve.add_argument('--error-rate', type=float, default=0,
+                       help='fraction of responses that fail')
+    serve.add_argument('--error-status', type=int, default=503)
+    serve.add_argument('--slow-rate', type=float, default=0,
+                       help='fraction of responses that take --slow-latency')
+    serve.add_argument('--slow-latency', type=float, default=5)
+    serve.add_argument('--seed', type=int, default=None)
+
+    rec = commands.add_parser('record', help='record fixtures from PokeAPI')
+    rec.add_argument('names', nargs='+')
+    rec.add_argument('--upstream', default=UPSTREAM_URL)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        written = record(args.names, args.fixtures, args.upstream)
+        print(f'Recorded {written} fixtures into {args.fixtures}')
+        return
+
+    server = StandInServer((args.host, args.port), Fixtures(args.fixtures),
+                           latency=args.latency, jitter=args.jitter,
+                           error_rate=args.error_rate, error_status=args.error_status,
+                           slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                           seed=args.seed)
+    print(f'Serving PokeAPI fixtures at {server.base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+// Fill a search box's <datalist> from /api/autocomplete as the user types.
+document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+    var lastQuery = null;
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            var query = input.value.trim();
+            if (!query || query === lastQuery) {
+                return;
+            }
+            lastQuery = query;
+            fetch(input.dataset.autocomplete + '?q=' + encodeURIComponent(query))
+                .then(function (res) { return res.json(); })
+                .then(function (data) {
+                    list.innerHTML = '';
+                    data.results.forEach(function (name) {
+                        var option = document.createElement('option');
+                        option.value = name.replace(/-/g, ' ').replace(/\b\w/g, function (c) { return c.toUpperCase(); });
+                        list.appendChild(option);
+                    });
+                })
+                .catch(function () {});
+        }, 150);
+    });
+});
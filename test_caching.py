@@ -0,0 +1,170 @@
+"""In-process cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_caching.py
+
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from caching import MISSING, BackgroundRefresher, SingleFlight, TTLCache
+
+
+class TTLCacheTestCase(TestCase):
+    """Test the LRU/TTL cache used in front of the PokeAPI fetch helpers."""
+
+    def test_hit_and_miss(self):
+        cache = TTLCache(max_entries=2)
+
+        self.assertIs(cache.get('pikachu'), MISSING)
+        cache.set('pikachu', {'id': 25})
+        self.assertEqual(cache.get('pikachu'), {'id': 25})
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(max_entries=2)
+        cache.set('bulbasaur', 1)
+        cache.set('ivysaur', 2)
+        # touch bulbasaur so ivysaur is the oldest
+        cache.get('bulbasaur')
+        cache.set('venusaur', 3)
+
+        self.assertIs(cache.get('ivysaur'), MISSING)
+        self.assertEqual(cache.get('bulbasaur'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_pinned_keys_are_never_evicted(self):
+        cache = TTLCache(max_entries=2, pinned=['pikachu'])
+        cache.set('pikachu', 25)
+        for i in range(10):
+            cache.set(f'poke{i}', i)
+
+        self.assertEqual(cache.get('pikachu'), 25)
+        self.assertEqual(len(cache), 2)
+
+    def test_memory_ceiling(self):
+        cache = TTLCache(max_entries=100, max_bytes=2000)
+        for i in range(20):
+            cache.set(i, 'x' * 200)
+
+        self.assertLessEqual(cache.stats()['bytes'], 2000)
+        self.assertGreater(cache.stats()['evictions'], 0)
+
+    def test_expiry(self):
+        cache = TTLCache(ttl=0.01)
+        cache.set('charizard', 6)
+        time.sleep(0.02)
+
+        self.assertIs(cache.get('charizard'), MISSING)
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_stale_window(self):
+        cache = TTLCache(ttl=0.01, stale_ttl=60)
+        cache.set('mewtwo', 150)
+        time.sleep(0.02)
+
+        # expired entries miss on get but can still be served while refreshing
+        self.assertIs(cache.get('mewtwo'), MISSING)
+        self.assertEqual(cache.peek('mewtwo'), (150, True))
+        self.assertEqual(cache.stats()['stale_hits'], 1)
+
+        cache.set('mewtwo', 150)
+        self.assertEqual(cache.peek('mewtwo'), (150, False))
+
+
+class SingleFlightTestCase(TestCase):
+    """Test request coalescing for upstream fetches."""
+
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return {'name': 'pikachu'}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do('pikachu', fetch)))
+        leader.start()
+        started.wait(1)
+        followers = [threading.Thread(target=lambda: results.append(flights.do('pikachu', fetch)))
+                     for i in range(5)]
+        for thread in followers:
+            thread.start()
+        # give followers time to join the flight before it lands
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(1)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'name': 'pikachu'}] * 6)
+        self.assertEqual(flights.stats()['coalesced'], 5)
+
+    def test_errors_are_not_cached(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError('upstream down')
+
+        with self.assertRaises(ValueError):
+            flights.do('mew', fail)
+        # the next call starts a new flight
+        self.assertEqual(flights.do('mew', lambda: 151), 151)
+
+    def test_cancelled_leader_hands_over_to_a_follower(self):
+        flights = SingleFlight()
+        executor = ThreadPoolExecutor(1)
+
+        async def never():
+            await asyncio.sleep(10)
+
+        async def scenario():
+            leader = asyncio.ensure_future(flights.ado('eevee', never))
+            await asyncio.sleep(0)
+            follower = executor.submit(flights.do, 'eevee', lambda: 133)
+            while flights.stats()['coalesced'] < 1:
+                await asyncio.sleep(0.01)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return follower.result(1)
+
+        # the follower runs the call itself rather than seeing the cancellation
+        self.assertEqual(asyncio.run(scenario()), 133)
+        self.assertEqual(flights.stats()['in_flight'], 0)
+        executor.shutdown()
+
+
+class BackgroundRefresherTestCase(TestCase):
+    """Test stale-while-revalidate background refreshes."""
+
+    def test_one_refresh_per_key(self):
+        refresher = BackgroundRefresher()
+        release = threading.Event()
+        done = threading.Event()
+
+        def refresh():
+            release.wait(1)
+            done.set()
+
+        self.assertTrue(refresher.submit('pikachu', refresh))
+        self.assertFalse(refresher.submit('pikachu', refresh))
+        release.set()
+        done.wait(1)
+        time.sleep(0.01)
+
+        self.assertEqual(refresher.stats()['scheduled'], 1)
+        self.assertTrue(refresher.submit('pikachu', refresh))
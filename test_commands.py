@@ -0,0 +1,78 @@
+"""CLI command tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_commands.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, FlavorText, PokemonData
+import standin
+
+# BEFORE we import our app, set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///pokedex-test"
+os.environ['POKEAPI_CACHE'] = "0"
+
+# Serve PokeAPI from the recorded fixtures instead of calling the live API
+
+pokeapi_standin = standin.start()
+os.environ['POKEAPI_BASE_URL'] = pokeapi_standin.base_url
+
+
+# Now we can import app
+
+from app import app
+
+db.create_all()
+
+
+class SyncCommandTestCase(TestCase):
+    """Test `flask pokedex sync`."""
+
+    def setUp(self):
+        """Start from an empty catalog."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.runner = app.test_cli_runner()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_sync(self):
+        """Sync loads every pokemon and species flavor text from PokeAPI"""
+
+        result = self.runner.invoke(args=['pokedex', 'sync'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Synced 3 pokemon (0 failed).', result.output)
+        self.assertIn('Synced flavor texts for 3 species (0 failed).', result.output)
+
+        pokemon = {row.name: row for row in PokemonData.query.all()}
+        self.assertEqual(set(pokemon), {'pichu', 'pikachu', 'raichu'})
+        self.assertEqual(pokemon['pikachu'].pokeapi_id, 25)
+        self.assertEqual(pokemon['pikachu'].types[0]['type']['name'], 'electric')
+
+        texts = FlavorText.query.filter_by(name='pikachu', language='en').one()
+        self.assertTrue(texts.texts)
+        self.assertEqual({row.name for row in FlavorText.query.all()},
+                         {'pichu', 'pikachu', 'raichu'})
+
+    def test_sync_skips_known_pokemon(self):
+        """A second sync only fetches pokemon missing from the catalog"""
+
+        self.runner.invoke(args=['pokedex', 'sync', '--limit', '1'])
+        result = self.runner.invoke(args=['pokedex', 'sync'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Syncing 2 pokemon...', result.output)
+        self.assertEqual(PokemonData.query.count(), 3)
@@ -0,0 +1,107 @@
+"""Catalog filter index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_filterindex.py
+
+
+import random
+from unittest import TestCase
+
+from filterindex import FilterIndex, ability_names, parse_filters, type_names
+
+
+def catalog_dict(id, name, types, abilities, height=None, weight=None, base_xp=None):
+    """Return a catalog dict with just the fields the index reads."""
+
+    return {'id': id, 'name': name,
+            'types': [{'slot': slot, 'type': {'name': type}}
+                      for slot, type in enumerate(types, 1)],
+            'abilities': [{'slot': slot, 'is_hidden': False, 'ability': {'name': ability}}
+                          for slot, ability in enumerate(abilities, 1)],
+            'height': height, 'weight': weight, 'base_xp': base_xp}
+
+
+POKEMON = [
+    catalog_dict(6, 'charizard', ['fire', 'flying'], ['blaze', 'solar-power'], 17, 905, 240),
+    catalog_dict(4, 'charmander', ['fire'], ['blaze', 'solar-power'], 6, 85, 62),
+    catalog_dict(5, 'charmeleon', ['fire'], ['blaze', 'solar-power'], 11, 190, 142),
+    catalog_dict(25, 'pikachu', ['electric'], ['static', 'lightning-rod'], 4, 60, 112),
+    catalog_dict(16, 'pidgey', ['normal', 'flying'], ['keen-eye'], 3, 18, None),
+]
+
+
+class ParseFiltersTestCase(TestCase):
+    """Test reading filters from query args."""
+
+    def test_parses_args(self):
+        filters = parse_filters({'type': ['Fire,flying'], 'ability': ['blaze', 'Solar Power'],
+                                 'min_weight': ['100'], 'max_height': ['20'],
+                                 'min_base_xp': ['']})
+
+        self.assertEqual(filters['types'], ['fire', 'flying'])
+        self.assertEqual(filters['abilities'], ['blaze', 'solar-power'])
+        self.assertEqual(filters['ranges'], {'weight': (100, None), 'height': (None, 20)})
+
+    def test_no_filters(self):
+        self.assertIsNone(parse_filters({}))
+        self.assertIsNone(parse_filters({'search': ['pikachu'], 'type': ['']}))
+
+    def test_bad_bound(self):
+        with self.assertRaises(ValueError):
+            parse_filters({'min_weight': ['heavy']})
+
+
+class FilterIndexTestCase(TestCase):
+    """Test filtering the catalog."""
+
+    def setUp(self):
+        self.index = FilterIndex(POKEMON)
+
+    def names(self, filters, limit=10, offset=0):
+        total, pokemon = self.index.page(filters, limit, offset)
+        return total, [poke['name'] for poke in pokemon]
+
+    def test_types_and_abilities(self):
+        self.assertEqual(self.names({'types': ['fire']}),
+                         (3, ['charmander', 'charmeleon', 'charizard']))
+        self.assertEqual(self.names({'types': ['fire', 'flying']}), (1, ['charizard']))
+        self.assertEqual(self.names({'abilities': ['static']}), (1, ['pikachu']))
+        self.assertEqual(self.names({'types': ['water']}), (0, []))
+
+    def test_ranges(self):
+        self.assertEqual(self.names({'ranges': {'weight': (85, 190)}}),
+                         (2, ['charmander', 'charmeleon']))
+        self.assertEqual(self.names({'types': ['flying'], 'ranges': {'height': (None, 10)}}),
+                         (1, ['pidgey']))
+        # pokemon without a value never match a range
+        self.assertEqual(self.names({'ranges': {'base_xp': (0, None)}})[0], 4)
+
+    def test_pages_in_dex_order(self):
+        self.assertEqual(self.names({'abilities': ['blaze']}, limit=2),
+                         (3, ['charmander', 'charmeleon']))
+        self.assertEqual(self.names({'abilities': ['blaze']}, limit=2, offset=2),
+                         (3, ['charizard']))
+
+    def test_matches_a_full_scan(self):
+        rng = random.Random(25)
+        types = ['fire', 'water', 'grass', 'flying', 'poison', 'bug']
+        abilities = ['blaze', 'torrent', 'overgrow', 'keen-eye', 'static']
+        pokemon = [catalog_dict(id, f'mon-{id}', rng.sample(types, rng.randint(1, 2)),
+                                rng.sample(abilities, 2), rng.randint(1, 30),
+                                rng.randint(1, 2000), rng.choice([None, rng.randint(30, 300)]))
+                   for id in range(1, 1200)]
+        index = FilterIndex(pokemon)
+
+        for i in range(50):
+            filters = {'types': rng.sample(types, rng.randint(0, 2)),
+                       'abilities': rng.sample(abilities, rng.randint(0, 1)),
+                       'ranges': {'weight': (rng.randint(1, 1000), rng.randint(1000, 2000))}}
+            expected = [poke['id'] for poke in pokemon
+                        if set(filters['types']) <= set(type_names(poke))
+                        and set(filters['abilities']) <= set(ability_names(poke))
+                        and filters['ranges']['weight'][0] <= poke['weight'] <= filters['ranges']['weight'][1]]
+            total, found = index.page(filters, 2000)
+
+            self.assertEqual(total, len(expected))
+            self.assertEqual([poke['id'] for poke in found], expected)
@@ -0,0 +1,54 @@
+"""Pokemon name index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_nameindex.py
+
+
+from unittest import TestCase
+
+from nameindex import PrefixIndex, edit_distance, fuzzy_names, pokemon_names
+
+
+class PrefixIndexTestCase(TestCase):
+    """Test autocomplete over pokemon names."""
+
+    def test_prefix_matches_in_dex_order(self):
+        index = PrefixIndex(['bulbasaur', 'pichu', 'pikachu', 'pidgey', 'pidgeotto'])
+
+        self.assertEqual(index.complete('pi'), ['pichu', 'pikachu', 'pidgey', 'pidgeotto'])
+        self.assertEqual(index.complete('pidg', limit=1), ['pidgey'])
+        self.assertEqual(index.complete('zubat'), [])
+        self.assertEqual(index.complete(''), [])
+
+    def test_hyphenated_parts_rank_after_whole_names(self):
+        index = PrefixIndex(['mr-mime', 'mime-jr', 'tapu-koko'])
+
+        self.assertEqual(index.complete('mime'), ['mime-jr', 'mr-mime'])
+        self.assertEqual(index.complete('Tapu K'), ['tapu-koko'])
+        self.assertEqual(index.complete('koko'), ['tapu-koko'])
+
+    def test_whole_catalog(self):
+        self.assertIn('pikachu', pokemon_names.complete('pika'))
+        self.assertLessEqual(len(pokemon_names.complete('a', limit=5)), 5)
+
+
+class FuzzyIndexTestCase(TestCase):
+    """Test "did you mean" suggestions."""
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('pikachu', 'pikachu'), 0)
+        self.assertEqual(edit_distance('pikachoo', 'pikachu'), 2)
+        self.assertEqual(edit_distance('charzard', 'charizard'), 1)
+        # gives up past the limit
+        self.assertEqual(edit_distance('pikachu', 'bulbasaur', limit=2), 3)
+
+    def test_suggests_closest_names(self):
+        self.assertEqual(fuzzy_names.suggest('pikachoo')[0], 'pikachu')
+        self.assertEqual(fuzzy_names.suggest('Bulbsaur')[0], 'bulbasaur')
+        self.assertEqual(fuzzy_names.suggest('mr mime')[0], 'mr-mime')
+        self.assertEqual(fuzzy_names.suggest('zzzzzzzz'), [])
+
+    def test_known_names(self):
+        self.assertIn('squirtle', fuzzy_names)
+        self.assertNotIn('squirtel', fuzzy_names)
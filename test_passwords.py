@@ -0,0 +1,58 @@
+"""Password hasher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import threading
+from unittest import TestCase
+
+from passwords import HasherBusy, PasswordHasher, rounds_of
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test bcrypt on the bounded pool."""
+
+    def test_hash_and_verify(self):
+        hasher = PasswordHasher(rounds=4)
+        hashed = hasher.hash('pikachu123')
+
+        self.assertEqual(rounds_of(hashed), 4)
+        self.assertTrue(hasher.verify(hashed, 'pikachu123'))
+        self.assertFalse(hasher.verify(hashed, 'raichu123'))
+
+    def test_rejects_empty_passwords(self):
+        hasher = PasswordHasher(rounds=4)
+
+        for password in ('', None):
+            with self.assertRaises(ValueError):
+                hasher.hash(password)
+            with self.assertRaises(ValueError):
+                hasher.verify(hasher.hash('pikachu123'), password)
+
+    def test_needs_rehash_when_cost_changes(self):
+        old = PasswordHasher(rounds=4).hash('pikachu123')
+
+        self.assertFalse(PasswordHasher(rounds=4).needs_rehash(old))
+        self.assertTrue(PasswordHasher(rounds=5).needs_rehash(old))
+
+    def test_rejects_when_queue_is_full(self):
+        hasher = PasswordHasher(rounds=4, queue_limit=1, queue_wait=0)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash():
+            started.set()
+            release.wait(1)
+
+        busy = threading.Thread(target=hasher._run, args=(slow_hash,))
+        busy.start()
+        started.wait(1)
+        with self.assertRaises(HasherBusy):
+            hasher.hash('pikachu123')
+        release.set()
+        busy.join(1)
+
+        self.assertEqual(hasher.stats()['rejected'], 1)
+        self.assertTrue(hasher.verify(hasher.hash('pikachu123'), 'pikachu123'))
@@ -0,0 +1,32 @@
+"""PokeAPI client tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pokeapi.py
+
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+import standin
+
+
+class RunSyncTestCase(TestCase):
+    """Test the sync wrappers around the async client."""
+
+    def test_first_call_in_a_fresh_process(self):
+        """The first `get_json` in a process starts the background loop and returns"""
+
+        upstream = standin.start()
+        env = dict(os.environ, POKEAPI_BASE_URL=upstream.base_url, POKEAPI_CACHE='0')
+        code = "import pokeapi; print(pokeapi.get_json('pokemon/pikachu')['id'])"
+        try:
+            result = subprocess.run([sys.executable, '-c', code], env=env,
+                                    capture_output=True, text=True, timeout=30)
+        finally:
+            upstream.shutdown()
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '25')
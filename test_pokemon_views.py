@@ -9,6 +9,7 @@ import os
 from unittest import TestCase
 
 from models import db, connect_db, User, Favorite, Pokemon
+import standin
 
 # BEFORE we import our app, set an environmental variable
 # to use a different database for tests (we need to do this
@@ -16,6 +17,12 @@ from models import db, connect_db, User, Favorite, Pokemon
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///pokedex-test"
+os.environ['POKEAPI_CACHE'] = "0"
+
+# Serve PokeAPI from the recorded fixtures instead of calling the live API
+
+pokeapi_standin = standin.start()
+os.environ['POKEAPI_BASE_URL'] = pokeapi_standin.base_url
 
 
 # Now we can import app
@@ -105,6 +112,35 @@ class PokemonViewTestCase(TestCase):
             self.assertIn("Invalid path", str(resp.data))
 
 
+# #######################################################################
+# AUTOCOMPLETE
+
+    def test_autocomplete(self):
+        """Suggest pokemon names for the search box, cacheable by browsers"""
+
+        with self.client as client:
+            res = client.get('/api/autocomplete?q=Pika&limit=3')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Cache-Control'], 'public, max-age=86400')
+        data = res.get_json()
+        self.assertEqual(data['query'], 'Pika')
+        self.assertEqual(data['results'][0], 'pikachu')
+        self.assertLessEqual(len(data['results']), 3)
+        for name in data['results']:
+            self.assertIn('pika', name)
+
+
+    def test_autocomplete_no_query(self):
+        """An empty query suggests nothing"""
+
+        with self.client as client:
+            res = client.get('/api/autocomplete')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json(), {'query': '', 'results': []})
+
+
 # #######################################################################
 # Test Invalid Routes (404, 405 errors)
 
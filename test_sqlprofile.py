@@ -0,0 +1,41 @@
+"""SQL query profiler tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_sqlprofile.py
+
+
+from unittest import TestCase
+
+from sqlprofile import QueryProfile, summarize
+
+FAVORITES_SQL = 'SELECT pokemon.name FROM pokemon JOIN favorites ON pokemon.name = favorites.poke_name WHERE %(param_1)s = favorites.user_id'
+
+
+class QueryProfileTestCase(TestCase):
+    """Test per-request query bookkeeping and N+1 detection."""
+
+    def test_counts_queries_and_time(self):
+        profile = QueryProfile()
+        profile.add('SELECT 1', 0.01)
+        profile.add('SELECT 2', 0.02)
+
+        self.assertEqual(profile.queries, 2)
+        self.assertAlmostEqual(profile.seconds, 0.03)
+        self.assertEqual(profile.repeated(threshold=2), [])
+
+    def test_flags_repeated_statements(self):
+        profile = QueryProfile()
+        profile.add('SELECT users.id FROM users WHERE users.id = %(pk_1)s', 0.001)
+        for i in range(5):
+            profile.add(FAVORITES_SQL, 0.002)
+
+        repeated = profile.repeated(threshold=3)
+        self.assertEqual(len(repeated), 1)
+        statement, count, seconds = repeated[0]
+        self.assertEqual(statement, FAVORITES_SQL)
+        self.assertEqual(count, 5)
+
+    def test_summarize(self):
+        self.assertEqual(summarize('SELECT *\n  FROM pokemon'), 'SELECT * FROM pokemon')
+        self.assertEqual(len(summarize(FAVORITES_SQL, length=40)), 40)
@@ -0,0 +1,76 @@
+"""PokeAPI stand-in tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_standin.py
+
+
+import json
+import urllib.error
+import urllib.request
+from unittest import TestCase
+
+import standin
+
+
+def get(url, headers=None):
+    """Return (status, json or None) for a GET to the stand-in."""
+
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as res:
+            return res.status, json.loads(res.read()), res.headers
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        return e.code, json.loads(body) if body else None, e.headers
+
+
+class StandInTestCase(TestCase):
+    """Test the recorded-fixture PokeAPI server."""
+
+    def setUp(self):
+        self.server = standin.start()
+        self.base_url = self.server.base_url
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_replays_fixtures_by_name_and_id(self):
+        status, pikachu, headers = get(f'{self.base_url}/pokemon/pikachu')
+        self.assertEqual(status, 200)
+        self.assertEqual(pikachu['id'], 25)
+
+        status, by_id, headers = get(f'{self.base_url}/pokemon/25/')
+        self.assertEqual(by_id, pikachu)
+
+    def test_links_point_back_at_the_stand_in(self):
+        status, pikachu, headers = get(f'{self.base_url}/pokemon/pikachu')
+        species_url = pikachu['species']['url']
+        self.assertTrue(species_url.startswith(self.base_url))
+
+        status, species, headers = get(species_url)
+        status, chain, headers = get(species['evolution_chain']['url'])
+        self.assertEqual(chain['chain']['species']['name'], 'pichu')
+
+    def test_unknown_pokemon_is_404(self):
+        status, body, headers = get(f'{self.base_url}/pokemon/99999')
+        self.assertEqual(status, 404)
+
+    def test_listing(self):
+        status, listing, headers = get(f'{self.base_url}/pokemon/?limit=2&offset=0')
+        self.assertEqual(listing['count'], 3)
+        self.assertEqual([poke['name'] for poke in listing['results']],
+                         ['pikachu', 'raichu'])
+
+    def test_etag_revalidation(self):
+        status, body, headers = get(f'{self.base_url}/pokemon/pikachu')
+        status, body, headers = get(f'{self.base_url}/pokemon/pikachu',
+                                    {'If-None-Match': headers['ETag']})
+        self.assertEqual(status, 304)
+
+    def test_injected_errors(self):
+        self.server.error_rate = 1
+        status, body, headers = get(f'{self.base_url}/pokemon/pikachu')
+        self.assertEqual(status, 503)
+        self.assertEqual(self.server.calls['pokemon'], 1)
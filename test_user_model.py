@@ -17,6 +17,7 @@ from models import db, User, Favorite, Pokemon
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///pokedex-test"
+os.environ['POKEAPI_CACHE'] = "0"
 
 
 # Now we can import app
@@ -98,6 +99,48 @@ class UserModelTestCase(TestCase):
 
         self.assertEqual(len(self.u1.favorites), 1)
 
+    def test_toggle_adds_favorite(self):
+        """Toggling a pokemon the user hasn't favorited adds it"""
+
+        db.session.add(Pokemon(name='charizard', pokeapi_id=6))
+        db.session.commit()
+
+        self.assertTrue(Favorite.toggle(self.u1id, 'charizard'))
+        db.session.commit()
+
+        self.assertTrue(Favorite.is_favorite(self.u1id, 'charizard'))
+        self.assertFalse(Favorite.is_favorite(self.u2id, 'charizard'))
+
+    def test_toggle_removes_favorite(self):
+        """Toggling a favorited pokemon removes it, leaving other favorites alone"""
+
+        db.session.add_all([Pokemon(name='charizard', pokeapi_id=6),
+                            Pokemon(name='pikachu', pokeapi_id=25)])
+        db.session.add_all([Favorite(user_id=self.u1id, poke_name='charizard'),
+                            Favorite(user_id=self.u1id, poke_name='pikachu'),
+                            Favorite(user_id=self.u2id, poke_name='charizard')])
+        db.session.commit()
+
+        self.assertFalse(Favorite.toggle(self.u1id, 'charizard'))
+        db.session.commit()
+
+        self.assertFalse(Favorite.is_favorite(self.u1id, 'charizard'))
+        self.assertTrue(Favorite.is_favorite(self.u1id, 'pikachu'))
+        self.assertTrue(Favorite.is_favorite(self.u2id, 'charizard'))
+
+    def test_double_toggle(self):
+        """Toggling twice leaves the favorites as they were"""
+
+        db.session.add(Pokemon(name='charizard', pokeapi_id=6))
+        db.session.commit()
+
+        self.assertTrue(Favorite.toggle(self.u1id, 'charizard'))
+        self.assertFalse(Favorite.toggle(self.u1id, 'charizard'))
+        db.session.commit()
+
+        self.assertFalse(Favorite.is_favorite(self.u1id, 'charizard'))
+        self.assertEqual(Favorite.query.count(), 0)
+
 
 ####### SIGNUP TESTS ######################
     def test_valid_signup(self):
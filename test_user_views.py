@@ -6,9 +6,12 @@
 
 
 import os
+import time
 from unittest import TestCase
 
+import identity
 from models import db, connect_db, User, Favorite, Pokemon
+import standin
 
 # BEFORE we import our app, set an environmental variable
 # to use a different database for tests (we need to do this
@@ -16,11 +19,17 @@ from models import db, connect_db, User, Favorite, Pokemon
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///pokedex-test"
+os.environ['POKEAPI_CACHE'] = "0"
+
+# Serve PokeAPI from the recorded fixtures instead of calling the live API
+
+pokeapi_standin = standin.start()
+os.environ['POKEAPI_BASE_URL'] = pokeapi_standin.base_url
 
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, USER_SNAPSHOT_KEY
 
 # Create tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -89,10 +98,108 @@ class UserViewTestCase(TestCase):
                             follow_redirects=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Caterpie", str(resp.data))
+            self.assertIn("Pikachu", str(resp.data))
             # Should redirect to home if user is not logged in and tries to access their user profile
 
 
+    def test_favorites_page_past_the_end(self):
+        """A favorites page past the last one 404s instead of showing no favorites"""
+        self.setup_favorites()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+
+            resp = client.get("/user?page=99")
+
+            self.assertEqual(resp.status_code, 404)
+
+
+# ###########################################################################
+# SESSION IDENTITY SNAPSHOT
+
+    def log_in_with_snapshot(self, client, **changes):
+        """Log in testuser with a session snapshot, overriding some of its values."""
+
+        values = identity.snapshot(self.testuser)
+        values.update(changes)
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.testuser.id
+            session[USER_SNAPSHOT_KEY] = values
+
+    def test_fresh_snapshot_is_used(self):
+        """A snapshot inside its TTL answers for the user without a query"""
+
+        with self.client as client:
+            self.log_in_with_snapshot(client, username="snapshotname")
+
+            resp = client.get("/user")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("snapshotname", str(resp.data))
+
+    def test_expired_snapshot_is_reloaded(self):
+        """A snapshot past its TTL is re-read from the database"""
+
+        with self.client as client:
+            self.log_in_with_snapshot(client, username="snapshotname",
+                                      taken_at=time.time() - identity.SNAPSHOT_TTL - 1)
+
+            resp = client.get("/user")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("testuser", str(resp.data))
+            with client.session_transaction() as session:
+                self.assertEqual(session[USER_SNAPSHOT_KEY]['username'], "testuser")
+
+    def test_profile_edit_refreshes_snapshot(self):
+        """Saving the profile updates the snapshot straight away"""
+
+        with self.client as client:
+            self.log_in_with_snapshot(client)
+
+            resp = client.post("/user/edit",
+                               data={"username": "newname", "email": "test@test.com",
+                                     "location": "Kanto", "password": "testuser"},
+                               follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("newname", str(resp.data))
+            with client.session_transaction() as session:
+                self.assertEqual(session[USER_SNAPSHOT_KEY]['username'], "newname")
+                self.assertEqual(session[USER_SNAPSHOT_KEY]['location'], "Kanto")
+
+    def test_delete_clears_snapshot(self):
+        """Deleting the account logs out and drops the snapshot"""
+
+        with self.client as client:
+            self.log_in_with_snapshot(client)
+
+            resp = client.post("/user/delete")
+
+            self.assertEqual(resp.status_code, 302)
+            with client.session_transaction() as session:
+                self.assertNotIn(CURR_USER_KEY, session)
+                self.assertNotIn(USER_SNAPSHOT_KEY, session)
+        self.assertIsNone(User.query.get(8888))
+
+    def test_expired_snapshot_of_deleted_user(self):
+        """Once its snapshot expires, a user deleted elsewhere is logged out"""
+
+        with self.client as client:
+            self.log_in_with_snapshot(client,
+                                      taken_at=time.time() - identity.SNAPSHOT_TTL - 1)
+            db.session.delete(User.query.get(8888))
+            db.session.commit()
+
+            resp = client.get("/user")
+
+            self.assertEqual(resp.status_code, 302)
+            with client.session_transaction() as session:
+                self.assertNotIn(CURR_USER_KEY, session)
+                self.assertNotIn(USER_SNAPSHOT_KEY, session)
+
+
 # ###########################################################################
 # FAVORITES ROUTES
 